@@ -0,0 +1,51 @@
+#!/usr/bin/python
+"""
+Compare the join and union change detection queries.
+
+Point PEEWEE_URL at a seeded metadata database and run from the root
+of the repository. On PostgreSQL the planner total cost is printed
+along with the wall time to count the matching objects.
+"""
+from datetime import datetime, timedelta
+from os.path import join, realpath
+from time import time
+import json
+import sys
+from peewee import PostgresqlDatabase
+import pacifica
+pacifica.__path__.append(join(realpath('.'), 'pacifica'))
+
+from pacifica.metadata.orm.base import DB
+from pacifica.metadata.rest.objectinfo import ObjectInfoAPI
+from pacifica.elasticsearch.search_render import SearchRender
+
+OBJECTS = ['transactions', 'projects', 'users', 'instruments', 'institutions', 'groups']
+days_ago = float(sys.argv[1]) if len(sys.argv) > 1 else 7
+time_delta = datetime.now() - timedelta(days=days_ago)
+
+
+def plan_cost(query):
+    if not isinstance(DB, PostgresqlDatabase):
+        return None
+    sql, params = query.sql()
+    cursor = DB.execute_sql('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Total Cost']
+
+
+print('{:<14} {:<6} {:>14} {:>10} {:>8}'.format('object', 'mode', 'cost', 'seconds', 'count'))
+for obj in OBJECTS:
+    render_cls = SearchRender.get_render_class(obj)
+    obj_cls = ObjectInfoAPI.get_class_object_from_name(obj)
+    for change_query in ['join', 'union']:
+        query = render_cls.get_select_query(
+            time_delta=time_delta, obj_cls=obj_cls, time_field='updated',
+            enable_paging=False, change_query=change_query
+        )
+        start = time()
+        count = query.count()
+        print('{:<14} {:<6} {:>14} {:>10.3f} {:>8}'.format(
+            obj, change_query, str(plan_cost(query)), time() - start, count
+        ))
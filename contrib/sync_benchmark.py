@@ -0,0 +1,324 @@
+#!/usr/bin/python
+"""
+Benchmark the search sync against a synthetic metadata database.
+
+The metadata database at --database-url is seeded with the requested
+numbers of objects, then each object type is synced in a fresh process
+to a stub elasticsearch bulk endpoint started by this script. For each
+object type the documents per second, database queries, bulk requests,
+payload sizes, bulk latency and peak RSS of the sync process are
+reported.
+
+Run from the root of the repository, for example:
+
+    python contrib/sync_benchmark.py --transactions 2000 --files 20 \\
+        --sync-args='--threads 4 --keyset-paging'
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from os.path import join, realpath
+from random import Random
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep, time
+from uuid import uuid4
+import json
+import os
+import resource
+import shlex
+
+OBJECTS = [
+    'keys', 'values', 'relationships', 'users', 'institutions',
+    'instruments', 'groups', 'projects', 'transactions'
+]
+
+
+class BulkStats:
+    """Payload sizes and latency of the bulk requests to the stub."""
+
+    def __init__(self):
+        """Start with no requests."""
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the recorded requests."""
+        self.requests = []
+
+    def record(self, payload_bytes, docs, seconds):
+        """Record a bulk request."""
+        with self.lock:
+            self.requests.append((payload_bytes, docs, seconds))
+
+    def to_hash(self):
+        """Return the totals of the recorded requests."""
+        with self.lock:
+            sizes = sorted(request[0] for request in self.requests)
+            latency = sum(request[2] for request in self.requests)
+            return {
+                'bulk_requests': len(sizes),
+                'docs_sent': sum(request[1] for request in self.requests),
+                'bytes_sent': sum(sizes),
+                'max_request_bytes': sizes[-1] if sizes else 0,
+                'median_request_bytes': sizes[len(sizes) // 2] if sizes else 0,
+                'avg_bulk_ms': round(1000 * latency / len(sizes), 2) if sizes else 0.0
+            }
+
+
+BULK_STATS = BulkStats()
+
+
+class StubElasticHandler(BaseHTTPRequestHandler):
+    """Just enough of the elasticsearch API for the search sync."""
+
+    protocol_version = 'HTTP/1.1'
+    bulk_latency = 0.0
+
+    # pylint: disable=invalid-name,arguments-differ
+    def log_message(self, *_args):
+        """Do not log the requests."""
+
+    def _send(self, obj):
+        """Send the object as the JSON response."""
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        """Read the request body."""
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_HEAD(self):
+        """Everything exists."""
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        """Answer the info request and acknowledge everything else."""
+        self._send({'version': {'number': '7.10.0'}, 'tagline': 'You Know, for Search'})
+
+    def do_PUT(self):
+        """Acknowledge the index and mapping requests."""
+        self._body()
+        self._send({'acknowledged': True})
+
+    def do_POST(self):
+        """Record the bulk requests, nothing is found by mget."""
+        start = time()
+        body = self._body()
+        path = self.path.split('?')[0]
+        if path.endswith('/_mget'):
+            self._send({'docs': [{'_id': _id, 'found': False} for _id in json.loads(body).get('ids', [])]})
+            return
+        if not path.endswith('/_bulk'):
+            self._send({'acknowledged': True})
+            return
+        items = []
+        lines = body.decode('utf-8').splitlines()
+        index = 0
+        while index < len(lines):
+            op_type, meta = next(iter(json.loads(lines[index]).items()))
+            index += 1 if op_type == 'delete' else 2
+            items.append({op_type: {'_id': meta.get('_id'), 'status': 200}})
+        sleep(self.bulk_latency)
+        self._send({'took': 1, 'errors': False, 'items': items})
+        BULK_STATS.record(len(body), len(items), time() - start)
+    # pylint: enable=invalid-name,arguments-differ
+
+
+def start_stub(bulk_latency):
+    """Start the stub elasticsearch server in a thread and return the url."""
+    StubElasticHandler.bulk_latency = bulk_latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubElasticHandler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def insert_rows(model, rows, batch_size=500):
+    """Insert the rows in batches."""
+    for start in range(0, len(rows), batch_size):
+        model.insert_many(rows[start:start + batch_size]).execute()
+
+
+# pylint: disable=too-many-locals
+def seed(args):
+    """Seed the metadata database with synthetic objects."""
+    # The environment needs to be set before import
+    # pylint: disable=import-outside-toplevel
+    from pacifica.metadata.orm.globals import DB
+    from pacifica.metadata.orm.sync import OrmSync
+    from pacifica.metadata.orm import (
+        Relationships, Institutions, Users, InstitutionUser, Groups, Instruments,
+        InstrumentGroup, Keys, Values, Projects, ProjectUser, ProjectInstrument, Transactions,
+        TransSIP, Files, TransactionKeyValue, TransactionUser, DOIEntries, DOITransaction
+    )
+    OrmSync.dbconn_blocking()
+    OrmSync.create_tables()
+    rand = Random(args.seed)
+    rel = {obj.name: obj.uuid for obj in Relationships.select()}
+    now = datetime.now()
+    with DB.atomic():
+        insert_rows(Institutions, [{'id': i, 'name': 'institution {}'.format(i)}
+                                   for i in range(1, args.institutions + 1)])
+        insert_rows(Users, [{
+            'id': i, 'first_name': 'first{}'.format(i), 'last_name': 'last{}'.format(i),
+            'middle_initial': 'm', 'network_id': 'user{}'.format(i), 'email_address': 'user{}@example.com'.format(i)
+        } for i in range(1, args.users + 1)])
+        insert_rows(InstitutionUser, [{
+            'user': i, 'institution': rand.randint(1, args.institutions), 'relationship': rel['member_of']
+        } for i in range(1, args.users + 1)])
+        insert_rows(Groups, [{'id': i, 'name': 'group{}'.format(i), 'display_name': 'Group {}'.format(i)}
+                             for i in range(1, args.groups + 1)])
+        insert_rows(Instruments, [{
+            'id': i, 'name': 'instrument{}'.format(i), 'display_name': 'Instrument {}'.format(i),
+            'name_short': 'inst{}'.format(i)
+        } for i in range(1, args.instruments + 1)])
+        insert_rows(InstrumentGroup, [{'instrument': i, 'group': rand.randint(1, args.groups)}
+                                      for i in range(1, args.instruments + 1)])
+        insert_rows(Keys, [{'id': i, 'key': 'key{}'.format(i), 'display_name': 'Key {}'.format(i)}
+                           for i in range(1, args.keys + 1)])
+        insert_rows(Values, [{'id': i, 'value': 'value{}'.format(i), 'display_name': 'Value {}'.format(i)}
+                             for i in range(1, args.values + 1)])
+        insert_rows(Projects, [{
+            'id': 'project{}'.format(i), 'title': 'Project {}'.format(i), 'abstract': 'Abstract {}'.format(i),
+            'science_theme': 'theme{}'.format(i % args.science_themes), 'accepted_date': now.date()
+        } for i in range(1, args.projects + 1)])
+        insert_rows(ProjectUser, [{
+            'project': 'project{}'.format(i), 'user': rand.randint(1, args.users),
+            'relationship': rel['principal_investigator']
+        } for i in range(1, args.projects + 1)])
+        insert_rows(ProjectInstrument, [{
+            'project': 'project{}'.format(i), 'instrument': rand.randint(1, args.instruments),
+            'relationship': rel['upload_required']
+        } for i in range(1, args.projects + 1)])
+        insert_rows(Transactions, [{'id': i, 'description': 'Transaction {}'.format(i)}
+                                   for i in range(1, args.transactions + 1)])
+        insert_rows(TransSIP, [{
+            'id': i, 'submitter': rand.randint(1, args.users), 'instrument': rand.randint(1, args.instruments),
+            'project': 'project{}'.format(rand.randint(1, args.projects))
+        } for i in range(1, args.transactions + 1)])
+        insert_rows(Files, [{
+            'name': 'file{}.dat'.format(j), 'subdir': 'data/{}'.format(j % 4), 'ctime': now, 'mtime': now,
+            'hashsum': '{:040x}'.format(i * args.files + j), 'hashtype': 'sha1', 'size': rand.randint(1, 1 << 30),
+            'transaction': i
+        } for i in range(1, args.transactions + 1) for j in range(args.files)])
+        # each (key, value) pair is used at most once per transaction
+        key_values = min(args.key_values, args.keys * args.values)
+        insert_rows(TransactionKeyValue, [{
+            'transaction': i, 'key': pair // args.values + 1, 'value': pair % args.values + 1
+        } for i in range(1, args.transactions + 1)
+            for pair in rand.sample(range(args.keys * args.values), key_values)])
+        released = [i for i in range(1, args.transactions + 1) if rand.random() < args.released]
+        trans_users = {i: uuid4() for i in released}
+        insert_rows(TransactionUser, [{
+            'uuid': trans_users[i], 'transaction': i, 'user': rand.randint(1, args.users),
+            'relationship': rel['authorized_releaser']
+        } for i in released])
+        with_doi = [i for i in released if rand.random() < args.with_doi]
+        insert_rows(DOIEntries, [{
+            'doi': '10.5555/benchmark.{}'.format(i), 'status': 'ok', 'site_url': 'https://example.com/{}'.format(i),
+            'creator': 1, 'encoding': 'UTF-8'
+        } for i in with_doi])
+        insert_rows(DOITransaction, [{'doi': '10.5555/benchmark.{}'.format(i), 'transaction': trans_users[i]}
+                                     for i in with_doi])
+# pylint: enable=too-many-locals
+
+
+def sync_object(obj, sync_args, checkpoint_file):
+    """Sync the object in this process and return the timing, query count and peak RSS."""
+    # The environment needs to be set before import
+    # pylint: disable=import-outside-toplevel
+    from pacifica.metadata.orm.globals import DB
+    from pacifica.elasticsearch.__main__ import main
+    queries = [0]
+    execute_sql = DB.execute_sql
+
+    def counting_execute_sql(*args, **kwargs):
+        """Count the query and execute it."""
+        queries[0] += 1
+        return execute_sql(*args, **kwargs)
+    DB.execute_sql = counting_execute_sql
+    start = time()
+    main(*(sync_args + ['--object', obj, '--checkpoint-file', checkpoint_file]))
+    return {
+        'seconds': time() - start,
+        'queries': queries[0],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    }
+
+
+def benchmark(args):
+    """Sync each object in a fresh process and return the results."""
+    results = []
+    checkpoint_file = join(mkdtemp(), 'checkpoint.json')
+    for obj in args.objects:
+        BULK_STATS.reset()
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(sync_object, obj, shlex.split(args.sync_args), checkpoint_file).result()
+        result.update(BULK_STATS.to_hash())
+        result['object'] = obj
+        result['docs_per_second'] = round(result['docs_sent'] / result['seconds'], 1) if result['seconds'] else 0.0
+        result['seconds'] = round(result['seconds'], 3)
+        results.append(result)
+    return results
+
+
+def print_results(results):
+    """Print the results as a table."""
+    columns = [
+        ('object', '{:<14}'), ('docs_sent', '{:>9}'), ('seconds', '{:>9}'), ('docs_per_second', '{:>9}'),
+        ('queries', '{:>9}'), ('bulk_requests', '{:>6}'), ('bytes_sent', '{:>11}'),
+        ('max_request_bytes', '{:>10}'), ('avg_bulk_ms', '{:>8}'), ('peak_rss_mb', '{:>8}')
+    ]
+    headers = ['object', 'docs', 'seconds', 'docs/s', 'queries', 'bulks', 'bytes', 'max bulk', 'bulk ms', 'rss MB']
+    print(' '.join(fmt.format(header) for (_key, fmt), header in zip(columns, headers)))
+    for result in results:
+        print(' '.join(fmt.format(result[key]) for key, fmt in columns))
+
+
+def main():
+    """Parse the arguments, seed the database and run the benchmark."""
+    parser = ArgumentParser(description='Benchmark the search sync with synthetic metadata.')
+    parser.add_argument('--database-url', default='sqlite:///{}'.format(join(mkdtemp(), 'metadata.sqlite')),
+                        help='peewee database url to seed and sync from.')
+    parser.add_argument('--skip-seed', action='store_true', help='use the already seeded database.')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the synthetic data.')
+    for name, default in [('institutions', 10), ('users', 200), ('groups', 5), ('instruments', 20),
+                          ('keys', 20), ('values', 50), ('projects', 100), ('science-themes', 10),
+                          ('transactions', 1000), ('files', 10), ('key-values', 2)]:
+        parser.add_argument('--{}'.format(name), type=int, default=default,
+                            help='number of {} (per transaction for files and key-values).'.format(name))
+    parser.add_argument('--released', type=float, default=0.3, help='fraction of released transactions.')
+    parser.add_argument('--with-doi', type=float, default=0.5, help='fraction of released transactions with a DOI.')
+    parser.add_argument('--objects', nargs='*', default=OBJECTS, help='objects to sync.')
+    parser.add_argument('--sync-args', default='--threads 4', help='extra search sync arguments.')
+    parser.add_argument('--bulk-latency', type=float, default=0.0, help='seconds the stub waits per bulk request.')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON.')
+    args = parser.parse_args()
+    os.environ['PEEWEE_URL'] = args.database_url
+    os.environ['ELASTIC_ENDPOINT'] = start_stub(args.bulk_latency)
+    os.environ['ELASTIC_ENABLE_SNIFF'] = 'False'
+    os.environ.setdefault('CACHE_SIZE', '10000')
+    if not args.skip_seed:
+        seed(args)
+    results = benchmark(args)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    # pylint: disable=wrong-import-position,ungrouped-imports
+    import pacifica
+    pacifica.__path__.append(join(realpath('.'), 'pacifica'))
+    main()
@@ -6,12 +6,14 @@ import logging
 from sys import argv as sys_argv
 from argparse import ArgumentParser
 from datetime import timedelta
-from .celery import SYNC_OBJECTS
+from .celery import DEFAULT_SYNC_OBJECTS, SYNC_OBJECTS
+from .globals import CHECKPOINT_FILE
 from .search_sync import search_sync
 
 logging.basicConfig()
 LOGGER = logging.getLogger('peewee')
 DEFAULT_CMP_DATES = ['created', 'updated']
+DEFAULT_TIME_AGO = timedelta(days=36500)
 
 
 def objstr_to_timedelta(obj_str):
@@ -42,6 +44,14 @@ def cmp_date_options(date_str):
     return date_str
 
 
+def rebuild_options(args):
+    """Validate the rebuild indexes every object and document."""
+    if set(args.objects) != set(DEFAULT_SYNC_OBJECTS) or args.time_ago != DEFAULT_TIME_AGO:
+        raise ValueError('--rebuild indexes all objects and can not be limited by --object or --time-ago')
+    if args.since_last_sync or args.skip_unchanged:
+        raise ValueError('--rebuild can not skip documents with --since-last-sync or --skip-unchanged')
+
+
 def searchsync_options(searchsync_parser):
     """Add the searchsync command line options."""
     searchsync_parser.add_argument(
@@ -52,7 +62,7 @@ def searchsync_options(searchsync_parser):
     searchsync_parser.add_argument(
         '--object', dest='objects',
         help='object to parse (i.e. --object="projects").',
-        nargs='*', default=set(SYNC_OBJECTS), type=object_options
+        nargs='*', default=set(DEFAULT_SYNC_OBJECTS), type=object_options
     )
     searchsync_parser.add_argument(
         '--compare-date', dest='compare_dates',
@@ -64,14 +74,74 @@ def searchsync_options(searchsync_parser):
         type=int, help='objects per bulk upload.',
         required=False, dest='items_per_page'
     )
+    searchsync_parser.add_argument(
+        '--keyset-paging', dest='keyset_paging', action='store_true',
+        help='page by primary key ranges instead of offsets.',
+        required=False, default=False
+    )
+    searchsync_parser.add_argument(
+        '--change-query', dest='change_query', default='union',
+        choices=['union', 'join'], required=False,
+        help='query changed objects with a union of id queries or a single join.'
+    )
+    searchsync_parser.add_argument(
+        '--files-as-documents', dest='files_as_docs', action='store_true',
+        help='sync files as their own documents and only file aggregates in transactions.',
+        required=False, default=False
+    )
+    searchsync_parser.add_argument(
+        '--skip-unchanged', dest='skip_unchanged', action='store_true',
+        help='skip documents with the same content hash as the indexed document.',
+        required=False, default=False
+    )
+    searchsync_parser.add_argument(
+        '--pipeline', dest='pipeline', action='store_true',
+        help='fetch, render and upload each page in concurrent stages.',
+        required=False, default=False
+    )
     searchsync_parser.add_argument(
         '--threads', default=4, required=False,
         type=int, help='number of threads to sync data',
     )
+    searchsync_parser.add_argument(
+        '--processes', default=0, required=False,
+        type=int, help='number of processes to sync data instead of threads',
+    )
+    searchsync_parser.add_argument(
+        '--async', dest='use_async', action='store_true',
+        help='sync data with an asyncio event loop and the async elasticsearch client.',
+        required=False, default=False
+    )
+    searchsync_parser.add_argument(
+        '--concurrency', default=4, required=False,
+        type=int, help='number of pages in flight with --async',
+    )
     searchsync_parser.add_argument(
         '--time-ago', dest='time_ago', type=objstr_to_timedelta,
         help='only objects newer than X days ago (i.e. --time-ago="7 days ago").',
-        required=False, default=timedelta(days=36500)
+        required=False, default=DEFAULT_TIME_AGO
+    )
+    searchsync_parser.add_argument(
+        '--since-last-sync', dest='since_last_sync', action='store_true',
+        help='only objects changed since the last successful sync of each object.',
+        required=False, default=False
+    )
+    searchsync_parser.add_argument(
+        '--checkpoint-file', dest='checkpoint_file', default=None,
+        help='file to store the last successful sync time of each object (default {} with --since-last-sync).'.format(
+            CHECKPOINT_FILE
+        ),
+        required=False
+    )
+    searchsync_parser.add_argument(
+        '--profile-queries', dest='profile_queries', type=int, nargs='?', const=20, default=0,
+        help='print the N render methods spending the most time in SQL queries (not with --celery).',
+        required=False, metavar='N'
+    )
+    searchsync_parser.add_argument(
+        '--rebuild', dest='rebuild', action='store_true',
+        help='index everything into a new index and swap the index alias to it when done.',
+        required=False, default=False
     )
     searchsync_parser.add_argument(
         '--celery', dest='celery', action='store_true',
@@ -94,4 +164,10 @@ def main(*argv):
     args = parser.parse_args(argv)
     if args.verbose:  # pragma: no cover this is for debugging
         LOGGER.setLevel('DEBUG')
+    if args.rebuild:
+        rebuild_options(args)
     return args.func(args)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
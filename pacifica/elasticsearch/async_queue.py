@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Asyncio work queue interface."""
+from __future__ import absolute_import
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from itertools import islice
+from threading import Event
+from elasticsearch import ElasticsearchException
+from tqdm import tqdm
+from .config import get_config
+from .connections import metadata_db, thread_connection
+from .instrumentation import JobMetrics, activate, emit
+from .search_render import STREAM_CHUNK_SIZE
+from .render.cache import TABLE_GENERATIONS
+from .unchanged import UnchangedFilter
+
+_DONE = object()
+
+
+def render_job(loop, chunks, stop, job, unchanged):
+    """Render the job in a worker thread and put chunks of actions on the queue."""
+    # pylint: disable=cyclic-import,import-outside-toplevel
+    from .search_sync import yield_data
+    # pylint: enable=cyclic-import
+
+    def put(chunk):
+        """Put the chunk on the queue waiting for room unless stopped."""
+        future = asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop)
+        while not stop.is_set():
+            try:
+                future.result(timeout=1)
+                return True
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    with thread_connection(metadata_db()):
+        TABLE_GENERATIONS.invalidate_changed(job['time_delta'])
+        actions = yield_data(**job)
+        if unchanged is not None:
+            actions = unchanged.filter(actions)
+        try:
+            chunk = list(islice(actions, STREAM_CHUNK_SIZE))
+            while chunk and put(chunk):
+                chunk = list(islice(actions, STREAM_CHUNK_SIZE))
+        finally:
+            actions.close()
+            put(_DONE)
+
+
+async def queue_actions(chunks):
+    """Yield the actions from the chunks on the queue until done."""
+    chunk = await chunks.get()
+    while chunk is not _DONE:
+        for action in chunk:
+            yield action
+        chunk = await chunks.get()
+
+
+class AsyncQueue:
+    """
+    Class to implement the queue interface with an asyncio event loop.
+
+    Each page is rendered in a thread pool and streamed through the
+    async bulk helper, so rendering some pages overlaps uploading
+    others. At most concurrency pages are in flight at once.
+    """
+
+    def __init__(self, concurrency):
+        """Save the concurrency and start with no jobs."""
+        self.concurrency = concurrency
+        self.jobs = []
+
+    def put(self, job_dict):
+        """Save the job dictionary to run in the event loop."""
+        job_dict.pop('num_pages')
+        self.jobs.append(job_dict)
+
+    def progress(self, _args, checkpoint):
+        """Run the jobs displaying progress as they complete and return overall success."""
+        return asyncio.run(self.run(checkpoint))
+
+    async def run(self, checkpoint):
+        """Run all the jobs with bounded concurrency."""
+        # the async client needs the optional aiohttp dependency
+        # pylint: disable=cyclic-import,import-outside-toplevel
+        from elasticsearch import AsyncElasticsearch
+        from .search_sync import es_client, es_client_kwargs
+        # pylint: enable=cyclic-import
+        cli = AsyncElasticsearch([get_config().get('elasticsearch', 'url')], **es_client_kwargs(self.concurrency))
+        sync_cli = es_client() if any(job.get('skip_unchanged') for job in self.jobs) else None
+        semaphore = asyncio.Semaphore(self.concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        success = True
+        try:
+            tasks = [self.try_doing_work(semaphore, executor, cli, sync_cli, job) for job in self.jobs]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc='Total Completed'):
+                job, job_success = await task
+                checkpoint.page_done(job, job_success)
+                if not job_success:  # pragma: no cover failure testing is hard
+                    success = False
+        finally:
+            await cli.close()
+            executor.shutdown()
+        return success
+
+    @classmethod
+    async def try_doing_work(cls, semaphore, executor, cli, sync_cli, job):
+        """Try doing some work even if you fail."""
+        async with semaphore:
+            metrics = JobMetrics(job)
+            success = False
+            tries_left = 5
+            with activate(metrics):
+                while tries_left:
+                    try:
+                        success = await cls.upload_job(executor, cli, sync_cli, job)
+                        break
+                    except ElasticsearchException:  # pragma: no cover
+                        tries_left -= 1
+            metrics.finish(success)
+            emit(metrics)
+        return job, success
+
+    @staticmethod
+    async def upload_job(executor, cli, sync_cli, job):
+        """Upload the documents for the job and return success."""
+        # pylint: disable=cyclic-import,import-outside-toplevel
+        from elasticsearch.helpers import async_streaming_bulk
+        from .search_sync import bulk_kwargs, print_failure, print_skipped
+        # pylint: enable=cyclic-import
+        chunks = asyncio.Queue(maxsize=2)
+        stop = Event()
+        unchanged = UnchangedFilter(sync_cli) if job.get('skip_unchanged') else None
+        # copy the context so the job metrics are active in the render thread
+        producer = asyncio.get_running_loop().run_in_executor(
+            executor, copy_context().run, render_job, asyncio.get_running_loop(), chunks, stop, job, unchanged
+        )
+        failures = []
+        try:
+            async for _success, item in async_streaming_bulk(cli, queue_actions(chunks), **bulk_kwargs()):
+                print_failure(item)  # pragma: no cover failure testing is hard
+                failures.append(item)  # pragma: no cover
+        finally:
+            stop.set()
+            await producer
+        if unchanged is not None:
+            unchanged.save(failures)
+            print_skipped(unchanged.skipped, job)
+        return not failures
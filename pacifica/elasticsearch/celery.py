@@ -1,8 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Celery work queue interface."""
-from __future__ import absolute_import
-from tqdm import trange
+from __future__ import absolute_import, print_function
+from collections import OrderedDict, deque
+from time import sleep, time
+from tqdm import tqdm
+from .config import get_config
+from .instrumentation import RUN_METRICS
 
 
 SYNC_OBJECTS = [
@@ -11,49 +15,124 @@ SYNC_OBJECTS = [
     'relationships',
     'transactions',
     'projects',
+    'science_themes',
     'users',
     'instruments',
     'institutions',
-    'groups'
+    'groups',
+    'files'
 ]
+# files are only their own documents with --files-as-documents
+DEFAULT_SYNC_OBJECTS = [obj for obj in SYNC_OBJECTS if obj != 'files']
 
 
 class CeleryQueue:
-    """Class to implement the queue interface."""
+    """
+    Class to implement the queue interface with celery tasks.
+
+    The pages of each object are sent in batches of celery_batch_size
+    per task and at most celery_max_in_flight tasks are sent to the
+    broker at once. The results are polled and finished tasks replaced
+    by the next batches, so slow pages do not hold up the progress of
+    the others and failed pages are resubmitted up to
+    celery_max_resubmits times. The job metrics returned by the tasks
+    are kept for the Prometheus textfile of the run.
+    """
 
     def __init__(self):
         """Default constructor."""
+        self.pending = OrderedDict()
+        self.in_flight = []
+        self.resubmits = {}
         self.by_obj_type = {}
-        self.all_jobs = []
 
     def put(self, job_dict):
-        """Save job dictionary and run job."""
+        """Save the job dictionary to send to celery."""
+        job_dict.pop('num_pages')
+        self.pending.setdefault(job_dict['object'], deque()).append(job_dict)
+
+    def _next_batch(self, batch_size):
+        """Return the next batch of jobs taking turns between the objects."""
+        obj, jobs = self.pending.popitem(last=False)
+        batch = [jobs.popleft() for _i in range(min(batch_size, len(jobs)))]
+        if jobs:
+            self.pending[obj] = jobs
+        return batch
+
+    def _submit(self, work_on_jobs, max_in_flight, batch_size):
+        """Send batches of pending jobs to celery until max_in_flight are running."""
+        while self.pending and len(self.in_flight) < max_in_flight:
+            batch = self._next_batch(batch_size)
+            self.by_obj_type.setdefault(batch[0]['object'], {'pages': 0, 'docs': 0, 'start': time(), 'end': 0.0})
+            self.in_flight.append((batch, work_on_jobs.delay(batch)))
+
+    @staticmethod
+    def _page_key(job_dict):
+        """Return the key of the page the job works on."""
+        return (job_dict['object'], job_dict['time_field'], job_dict['page'])
+
+    def _resubmit(self, job_dict, max_resubmits):
+        """Put the failed job back on the pending jobs and return if it was."""
+        key = self._page_key(job_dict)
+        if self.resubmits.get(key, 0) >= max_resubmits:
+            self.resubmits.pop(key, None)
+            return False
+        self.resubmits[key] = self.resubmits.get(key, 0) + 1
+        self.pending.setdefault(job_dict['object'], deque()).appendleft(job_dict)
+        return True
+
+    def _finished(self, max_resubmits):
+        """Return the finished jobs and their success resubmitting the failed ones."""
+        finished = []
+        running = []
+        for batch, result in self.in_flight:
+            if not result.ready():
+                running.append((batch, result))
+                continue
+            stats = result.result if result.successful() else {'success': [False] * len(batch), 'docs': 0}
+            RUN_METRICS.extend(stats.get('metrics', []))
+            obj_stats = self.by_obj_type[batch[0]['object']]
+            obj_stats['docs'] += stats['docs']
+            obj_stats['end'] = time()
+            for job_dict, job_success in zip(batch, stats['success']):
+                if not job_success and self._resubmit(job_dict, max_resubmits):
+                    continue
+                self.resubmits.pop(self._page_key(job_dict), None)
+                obj_stats['pages'] += 1
+                finished.append((job_dict, job_success))
+        self.in_flight = running
+        return finished
+
+    def progress(self, _args, checkpoint):
+        """Keep the tasks in flight and display progress as they finish."""
         # pylint: disable=cyclic-import,import-outside-toplevel
-        from .tasks import work_on_job
+        from .tasks import work_on_jobs
         # pylint: enable=cyclic-import
-        job_dict.pop('num_pages')
-        result = work_on_job.delay(job_dict)
-        self.all_jobs.append((job_dict, result))
-        if not job_dict['object'] in self.by_obj_type:
-            self.by_obj_type[job_dict['object']] = []
-        self.by_obj_type[job_dict['object']].append((job_dict, result))
-
-    def progress(self, args):
-        """
-        Display progress bars on all items working.
-
-        This is going to do the naive thing for now, a better
-        solution would be to dynamically walk all jobs finding
-        complete ones and updating instead of blocking on a job
-        waiting for it to complete.
-        """
+        max_in_flight = get_config().getint('celery', 'max_in_flight')
+        max_resubmits = get_config().getint('celery', 'max_resubmits')
+        batch_size = get_config().getint('celery', 'batch_size')
+        poll_interval = get_config().getfloat('celery', 'poll_interval')
         success = True
-        obj_list = list(args.objects)
-        for object_index in trange(len(obj_list), desc='Total Completed'):
-            object_name = obj_list[object_index]
-            job_list = self.by_obj_type[object_name]
-            for job_index in trange(len(job_list), desc='Total {} Completed'.format(object_name)):
-                _job_dict, result = self.by_obj_type[object_name][job_index]
-                if not result.get():  # pragma: no cover failure testing is hard
-                    success = False
+        with tqdm(total=sum(len(jobs) for jobs in self.pending.values()), desc='Total Completed') as pbar:
+            self._submit(work_on_jobs, max_in_flight, batch_size)
+            while self.in_flight:
+                finished = self._finished(max_resubmits)
+                for job_dict, job_success in finished:
+                    checkpoint.page_done(job_dict, job_success)
+                    if not job_success:  # pragma: no cover failure testing is hard
+                        success = False
+                pbar.update(len(finished))
+                self._submit(work_on_jobs, max_in_flight, batch_size)
+                if not finished:
+                    sleep(poll_interval)
+        self.print_throughput()
         return success
+
+    def print_throughput(self):
+        """Print the pages and documents per second for each object type."""
+        for obj, obj_stats in sorted(self.by_obj_type.items()):
+            elapsed = max(obj_stats['end'] - obj_stats['start'], 0.001)
+            print('Celery {obj}: {pages} pages {docs} docs in {elapsed:.3f}s {rate:.1f} docs/s'.format(
+                obj=obj, pages=obj_stats['pages'], docs=obj_stats['docs'], elapsed=elapsed,
+                rate=obj_stats['docs'] / elapsed
+            ))
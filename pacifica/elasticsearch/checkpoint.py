@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Persistent sync checkpoints for incremental search sync."""
+import os
+from json import dumps, loads
+from threading import Lock
+from datetime import datetime
+
+
+class SyncCheckpoint:
+    """
+    High water marks per object and compare date field.
+
+    A mark is the time the sync of an object started and is only
+    saved after every page for that object and compare date has
+    succeeded and the sync window covered the previous mark. Without
+    a filename the marks are only kept in memory.
+    """
+
+    def __init__(self, filename=None):
+        """Load the checkpoints from the file."""
+        self.filename = filename
+        self._lock = Lock()
+        self._pending = {}
+        self.failed_pages = 0
+        self.marks = {}
+        if filename and os.path.exists(filename):
+            with open(filename) as checkpoint_fd:
+                self.marks = loads(checkpoint_fd.read())
+
+    def get(self, obj, time_field):
+        """Return the high water mark datetime or None."""
+        mark = self.marks.get(obj, {}).get(time_field)
+        if mark is None:
+            return None
+        return datetime.strptime(mark, '%Y-%m-%dT%H:%M:%S')
+
+    def expect(self, obj, time_field, num_pages, time_delta, sync_time):
+        """Expect a number of pages for the object synced from time_delta."""
+        previous = self.get(obj, time_field)
+        covered = previous is None or time_delta <= previous
+        with self._lock:
+            self._pending[(obj, time_field)] = [num_pages, covered, sync_time]
+        if not num_pages:
+            self._complete(obj, time_field)
+
+    def page_done(self, job, success):
+        """Record a page for the job as done."""
+        key = (job['object'], job['time_field'])
+        with self._lock:
+            self.failed_pages += 0 if success else 1
+            pending = self._pending.get(key)
+            if pending is None:
+                return
+            if not success:
+                pending[1] = False
+            pending[0] -= 1
+            num_pages = pending[0]
+        if not num_pages:
+            self._complete(*key)
+
+    def _complete(self, obj, time_field):
+        """Save the mark for the object if the sync covered the previous mark."""
+        with self._lock:
+            _num_pages, covered, sync_time = self._pending.pop((obj, time_field))
+            if not covered:
+                return
+            self.marks.setdefault(obj, {})[time_field] = sync_time.strftime('%Y-%m-%dT%H:%M:%S')
+            if self.filename:
+                self._save()
+
+    def _save(self):
+        """Atomically write the checkpoints to the file."""
+        checkpoint_dir = os.path.dirname(self.filename)
+        if checkpoint_dir and not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        tmp_filename = '{}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w') as checkpoint_fd:
+            checkpoint_fd.write(dumps(self.marks, indent=4, sort_keys=True))
+        os.replace(tmp_filename, self.filename)
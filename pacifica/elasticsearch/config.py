@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """Configuration reading and validation module."""
 from os import getenv
+from os.path import expanduser, join
 from configparser import ConfigParser as SafeConfigParser
 from functools import lru_cache
 from .globals import CONFIG_FILE
@@ -36,15 +37,71 @@ def get_config():
         'BROKER_URL', 'pyamqp://'))
     configparser.set('celery', 'backend_url', getenv(
         'BACKEND_URL', 'rpc://'))
+    configparser.set('celery', 'max_in_flight', getenv(
+        'CELERY_MAX_IN_FLIGHT', '64'))
+    configparser.set('celery', 'batch_size', getenv(
+        'CELERY_BATCH_SIZE', '1'))
+    configparser.set('celery', 'max_resubmits', getenv(
+        'CELERY_MAX_RESUBMITS', '2'))
+    configparser.set('celery', 'poll_interval', getenv(
+        'CELERY_POLL_INTERVAL', '0.5'))
     configparser.add_section('elasticsearch')
     configparser.set('elasticsearch', 'cache_size', getenv(
         'CACHE_SIZE', '10000'))
+    configparser.set('elasticsearch', 'cache_backend', getenv(
+        'CACHE_BACKEND', 'memory'))
+    configparser.set('elasticsearch', 'cache_url', getenv(
+        'CACHE_URL', join(expanduser('~'), '.pacifica-elasticsearch', 'cache.sqlite')))
+    configparser.set('elasticsearch', 'cache_ttl', getenv(
+        'CACHE_TTL', '0'))
+    configparser.set('elasticsearch', 'render_memo_size', getenv(
+        'RENDER_MEMO_SIZE', '10000'))
+    configparser.set('elasticsearch', 'content_hash_index', getenv(
+        'CONTENT_HASH_INDEX', ''))
+    configparser.set('elasticsearch', 'prefetch_chunk_size', getenv(
+        'PREFETCH_CHUNK_SIZE', '5000'))
+    configparser.set('elasticsearch', 'stream_chunk_size', getenv(
+        'STREAM_CHUNK_SIZE', '1000'))
+    configparser.set('elasticsearch', 'bulk_chunk_size', getenv(
+        'BULK_CHUNK_SIZE', '500'))
+    configparser.set('elasticsearch', 'bulk_max_chunk_bytes', getenv(
+        'BULK_MAX_CHUNK_BYTES', '10485760'))
+    configparser.set('elasticsearch', 'bulk_max_retries', getenv(
+        'BULK_MAX_RETRIES', '5'))
+    configparser.set('elasticsearch', 'bulk_initial_backoff', getenv(
+        'BULK_INITIAL_BACKOFF', '2'))
+    configparser.set('elasticsearch', 'bulk_max_backoff', getenv(
+        'BULK_MAX_BACKOFF', '600'))
+    configparser.set('elasticsearch', 'pipeline_fetch_workers', getenv(
+        'PIPELINE_FETCH_WORKERS', '1'))
+    configparser.set('elasticsearch', 'pipeline_render_workers', getenv(
+        'PIPELINE_RENDER_WORKERS', '2'))
+    configparser.set('elasticsearch', 'pipeline_upload_workers', getenv(
+        'PIPELINE_UPLOAD_WORKERS', '2'))
+    configparser.set('elasticsearch', 'pipeline_queue_size', getenv(
+        'PIPELINE_QUEUE_SIZE', '4'))
+    configparser.set('elasticsearch', 'metrics_file', getenv(
+        'METRICS_FILE', ''))
+    configparser.set('elasticsearch', 'prometheus_textfile', getenv(
+        'PROMETHEUS_TEXTFILE', ''))
+    configparser.set('elasticsearch', 'db_pool_timeout', getenv(
+        'DB_POOL_TIMEOUT', '60'))
+    configparser.set('elasticsearch', 'db_pool_stale_timeout', getenv(
+        'DB_POOL_STALE_TIMEOUT', '300'))
+    configparser.set('elasticsearch', 'rebuild_max_num_segments', getenv(
+        'REBUILD_MAX_NUM_SEGMENTS', '1'))
+    configparser.set('elasticsearch', 'rebuild_timeout', getenv(
+        'REBUILD_TIMEOUT', '3600'))
     configparser.set('elasticsearch', 'url', getenv(
         'ELASTIC_ENDPOINT', 'http://127.0.0.1:9200'))
     configparser.set('elasticsearch', 'index', getenv(
         'ELASTIC_INDEX', 'pacifica_search'))
     configparser.set('elasticsearch', 'timeout', getenv(
         'ELASTIC_TIMEOUT', '60'))
+    configparser.set('elasticsearch', 'maxsize', getenv(
+        'ELASTIC_MAXSIZE', '10'))
+    configparser.set('elasticsearch', 'http_compress', getenv(
+        'ELASTIC_HTTP_COMPRESS', 'False'))
     configparser.set('elasticsearch', 'sniff', getenv(
         'ELASTIC_ENABLE_SNIFF', 'True'))
     configparser.read(CONFIG_FILE)
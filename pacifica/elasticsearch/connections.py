@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Metadata database connection pooling for the sync workers."""
+from contextlib import contextmanager
+from time import time
+from urllib.parse import parse_qsl, urlencode
+from playhouse.db_url import parse
+from playhouse.pool import PooledDatabase
+from .config import get_config
+from .instrumentation import count
+
+
+def metadata_db():
+    """Return the metadata database the models are bound to."""
+    # pylint: disable=import-outside-toplevel
+    from pacifica.metadata.orm.globals import DB
+    return DB
+
+
+def metadata_db_url():
+    """Return the peewee url the metadata database was connected with."""
+    # pylint: disable=import-outside-toplevel
+    from pacifica.metadata.config import get_config as metadata_config
+    return metadata_config().get('database', 'peewee_url')
+
+
+def is_pooled(database):
+    """Return whether the database hands out connections from a pool."""
+    return isinstance(database, PooledDatabase)
+
+
+def pooled_db_url(url, max_connections):
+    """Return the peewee url with the pool size and timeouts unless the url already sets them."""
+    base_url, _sep, query = url.partition('?')
+    params = dict(parse_qsl(query, keep_blank_values=True))
+    params.setdefault('max_connections', max_connections)
+    params.setdefault('stale_timeout', get_config().getint('elasticsearch', 'db_pool_stale_timeout'))
+    params.setdefault('timeout', get_config().getint('elasticsearch', 'db_pool_timeout'))
+    return '{}?{}'.format(base_url, urlencode(params))
+
+
+def configure_db_pool(database, size, url=None):
+    """
+    Size the pool of the database from the parameters of its peewee url.
+
+    The pool only exists if the peewee url uses a pooled scheme
+    (i.e. postgresext+pool://), the database is then initialized
+    again with the connection parameters playhouse.db_url parses
+    from the url with the pool parameters added.
+    """
+    if not is_pooled(database):
+        return
+    params = parse(pooled_db_url(url or metadata_db_url(), size))
+    database.init(params.pop('database'), **params)
+
+
+@contextmanager
+def thread_connection(database, reuse=True):
+    """
+    Connect this thread for the context and count the time waiting for the connection.
+
+    A pooled connection is given back to the pool at the end of the
+    context unless this thread was already connected. Other connections
+    are kept open for the next job of the thread unless reuse is off
+    for threads ending with the job.
+    """
+    opened = database.is_closed()
+    if opened:
+        start = time()
+        database.connect()
+        count('db_connections')
+        count('db_wait_seconds', time() - start)
+    try:
+        yield database
+    finally:
+        if opened and (is_pooled(database) or not reuse) and not database.is_closed():
+            database.close()
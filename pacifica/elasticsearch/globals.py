@@ -12,3 +12,7 @@ CHERRYPY_CONFIG = getenv(
     'ELASTICSEARCH_CPCONFIG',
     join(expanduser('~'), '.pacifica-elasticsearch', 'cpconfig.ini')
 )
+CHECKPOINT_FILE = getenv(
+    'ELASTICSEARCH_CHECKPOINT',
+    join(expanduser('~'), '.pacifica-elasticsearch', 'checkpoint.json')
+)
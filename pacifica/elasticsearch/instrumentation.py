@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Per job timing and counters emitted as JSON lines and a Prometheus textfile."""
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dumps
+from threading import Lock
+from time import time
+from elasticsearch.serializer import JSONSerializer
+from six import string_types
+from .config import get_config
+
+STAGES = ['select', 'render', 'upload']
+COUNTERS = ['docs', 'skipped', 'rel_lookups', 'prefetch_hits', 'cache_hits', 'cache_misses', 'bytes_sent',
+            'db_connections', 'db_wait_seconds']
+TOTALS = ['jobs', 'failed_jobs', 'elapsed_seconds'] + ['{}_seconds'.format(stage) for stage in STAGES] + COUNTERS
+_CURRENT = ContextVar('job_metrics', default=None)
+_EMIT_LOCK = Lock()
+LOGGER = logging.getLogger(__name__)
+
+
+class JobMetrics:  # pylint: disable=too-many-instance-attributes
+    """
+    Thread safe timing and counters for a sync job.
+
+    The metrics are active in the context of the threads and tasks
+    working on the job so the renderers, caches and serializer count
+    against the job without passing it around.
+    """
+
+    def __init__(self, job):
+        """Start the clock with every counter at zero."""
+        self.job = job
+        self._lock = Lock()
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.staged = False
+        self.start = time()
+        self.elapsed = 0.0
+        self.success = None
+
+    def add(self, name, value=1):
+        """Add the value to the counter."""
+        with self._lock:
+            self.counters[name] += value
+
+    def add_seconds(self, stage, seconds):
+        """Add the seconds spent in the stage."""
+        with self._lock:
+            self.seconds[stage] += seconds
+
+    def set_stages(self, seconds):
+        """Set the busy seconds of each stage for jobs whose stages overlap."""
+        with self._lock:
+            self.seconds.update(seconds)
+            self.staged = True
+
+    def finish(self, success):
+        """
+        Stop the clock and split the elapsed time into stages.
+
+        The select time is spent inside the render timer so it is taken
+        out of it and the rest of the elapsed time is the bulk upload.
+        """
+        self.elapsed = time() - self.start
+        self.success = success
+        if not self.staged:
+            self.seconds['render'] = max(0.0, self.seconds['render'] - self.seconds['select'])
+            self.seconds['upload'] = max(0.0, self.elapsed - self.seconds['render'] - self.seconds['select'])
+
+    def to_hash(self):
+        """Return the job labels, timing and counters as a dictionary."""
+        ret = {
+            'object': self.job['object'],
+            'time_field': self.job['time_field'],
+            'page': self.job['page'],
+            'success': self.success,
+            'elapsed_seconds': round(self.elapsed, 6),
+            'docs_per_second': round(self.counters['docs'] / self.elapsed, 1) if self.elapsed else 0.0
+        }
+        for stage in STAGES:
+            ret['{}_seconds'.format(stage)] = round(self.seconds[stage], 6)
+        ret.update(self.counters)
+        ret['db_wait_seconds'] = round(self.counters['db_wait_seconds'], 6)
+        return ret
+
+
+class RunMetrics:
+    """Thread safe list of the finished job metrics of the run."""
+
+    def __init__(self):
+        """Start with no jobs."""
+        self._lock = Lock()
+        self.jobs = []
+
+    def extend(self, job_hashes):
+        """Add the finished job metrics."""
+        with self._lock:
+            self.jobs.extend(job_hashes)
+
+    def drain(self):
+        """Return and forget the finished job metrics."""
+        with self._lock:
+            jobs, self.jobs = self.jobs, []
+            return jobs
+
+    def by_object(self):
+        """Return the sums of the job metrics for each object."""
+        totals = {}
+        with self._lock:
+            for job_hash in self.jobs:
+                total = totals.setdefault(job_hash['object'], dict.fromkeys(TOTALS, 0))
+                total['jobs'] += 1
+                total['failed_jobs'] += 0 if job_hash['success'] else 1
+                for key in total:
+                    if key in job_hash and key != 'success':
+                        total[key] += job_hash[key]
+        return totals
+
+    def write_prometheus(self, filename):
+        """Write the metrics per object to the Prometheus textfile atomically."""
+        samples = {}
+        for name, values in sorted(self.by_object().items()):
+            values['docs_per_second'] = values['docs'] / values['elapsed_seconds'] if values['elapsed_seconds'] else 0.0
+            for key, value in values.items():
+                samples.setdefault(key, []).append('pacifica_search_sync_{}{{object="{}"}} {}'.format(key, name, value))
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'w') as textfile:
+            for key in sorted(samples):
+                textfile.write('# TYPE pacifica_search_sync_{} gauge\n'.format(key))
+                textfile.write(''.join('{}\n'.format(sample) for sample in samples[key]))
+        os.rename(tmp_filename, filename)
+
+
+RUN_METRICS = RunMetrics()
+
+
+class CountingSerializer(JSONSerializer):
+    """JSON serializer counting the bytes of the request bodies for the job."""
+
+    def dumps(self, data):
+        """Serialize the data and count the bytes unless it already was serialized."""
+        ret = super().dumps(data)
+        if not isinstance(data, string_types):
+            count('bytes_sent', len(ret.encode('utf-8')))
+        return ret
+
+
+def current_metrics():
+    """Return the job metrics active in this context or None."""
+    return _CURRENT.get()
+
+
+@contextmanager
+def activate(metrics):
+    """Make the job metrics active in this context."""
+    token = _CURRENT.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _CURRENT.reset(token)
+
+
+def count(name, value=1):
+    """Add the value to the counter of the active job metrics if any."""
+    metrics = _CURRENT.get()
+    if metrics is not None:
+        metrics.add(name, value)
+
+
+def timed(stage, iterable):
+    """Yield from the iterable adding the time spent getting each item to the stage."""
+    metrics = _CURRENT.get()
+    if metrics is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                metrics.add_seconds(stage, time() - start)
+            yield item
+    finally:
+        getattr(iterator, 'close', lambda: None)()
+
+
+def emit(metrics):
+    """Keep the finished job metrics for the run and write them as a JSON line if configured or log them."""
+    job_hash = metrics.to_hash()
+    RUN_METRICS.extend([job_hash])
+    filename = get_config().get('elasticsearch', 'metrics_file')
+    if not filename:
+        LOGGER.debug('%s', dumps(job_hash, sort_keys=True))
+        return
+    with _EMIT_LOCK:
+        with open(filename, 'a') as metrics_file:
+            metrics_file.write('{}\n'.format(dumps(job_hash, sort_keys=True)))
+
+
+def write_run_metrics():
+    """Write the metrics of the run to the Prometheus textfile if configured and forget them."""
+    filename = get_config().get('elasticsearch', 'prometheus_textfile')
+    if filename:
+        RUN_METRICS.write_prometheus(filename)
+    RUN_METRICS.drain()
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Staged fetch, render and upload pipeline for a sync job."""
+from __future__ import print_function, absolute_import
+from math import ceil
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from time import time
+from peewee import fn
+from .config import get_config
+from .connections import metadata_db, thread_connection
+from .instrumentation import activate, current_metrics
+from .search_render import SearchRender
+from .render.base import keyset_range, render_memo
+from .unchanged import UnchangedFilter
+
+_DONE = object()
+STAGES = ['fetch', 'render', 'upload']
+
+
+class StageStats:
+    """
+    Thread safe throughput and queue depth counters for a stage.
+
+    The queue depth is of the queue the stage reads from, or for the
+    fetch stage the queue it writes to.
+    """
+
+    def __init__(self, name):
+        """Start the counters at zero."""
+        self.name = name
+        self._lock = Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+        self.samples = 0
+
+    def record(self, items, seconds, depth):
+        """Record the items done in seconds and the input queue depth before."""
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+            self.depth_total += depth
+            self.depth_max = max(self.depth_max, depth)
+            self.samples += 1
+
+    def to_hash(self):
+        """Return the counters as a dictionary with the rate per busy second."""
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 3),
+            'items_per_second': round(self.items / self.busy, 1) if self.busy else 0.0,
+            'avg_queue_depth': round(float(self.depth_total) / self.samples, 2) if self.samples else 0.0,
+            'max_queue_depth': self.depth_max
+        }
+
+
+def fetch_queries(job, fetchers):
+    """Split the query for the page of the job into at most fetchers queries."""
+    render_cls = SearchRender.get_render_class(job['object'])
+    query = render_cls.get_select_query(
+        obj_cls=render_cls.object_class(), time_delta=job['time_delta'],
+        time_field=job['time_field'], change_query=job.get('change_query', 'union'),
+        enable_paging=False
+    )
+    if 'id_high' in job:
+        # pylint: disable=protected-access
+        primary_key = query.model._meta.primary_key
+        # pylint: enable=protected-access
+        id_low = job.get('id_low')
+        if id_low is None:
+            id_low = query.select(fn.MIN(primary_key)).order_by().scalar()
+            id_low = id_low - 1 if isinstance(id_low, int) else None
+        if not isinstance(id_low, int) or not isinstance(job['id_high'], int):
+            return [keyset_range(query, job.get('id_low'), job['id_high'])]
+        step = max(1, int(ceil(float(job['id_high'] - id_low) / fetchers)))
+        bounds = list(range(id_low, job['id_high'], step))[1:] + [job['id_high']]
+        return [keyset_range(query, low, high) for low, high in zip([id_low] + bounds[:-1], bounds)]
+    offset = (job['page'] - 1) * job['items_per_page']
+    step = int(ceil(float(job['items_per_page']) / fetchers))
+    return [
+        query.offset(offset + start).limit(min(step, job['items_per_page'] - start))
+        for start in range(0, job['items_per_page'], step)
+    ]
+
+
+class SyncPipeline:  # pylint: disable=too-many-instance-attributes
+    """
+    Fetch, render and upload the documents for a job in stages.
+
+    Each stage runs in its own threads connected by bounded queues so
+    the database, the renderers and elasticsearch work at the same
+    time. Fetchers stream chunks of objects for a slice of the page,
+    renderers prefetch and render the chunks and uploaders send the
+    bulk actions.
+    """
+
+    def __init__(self, cli):
+        """Read the stage parallelism from the configuration."""
+        self.cli = cli
+        self.workers = {
+            name: get_config().getint('elasticsearch', 'pipeline_{}_workers'.format(name))
+            for name in STAGES
+        }
+        self.stats = {name: StageStats(name) for name in STAGES}
+        self.abort = Event()
+        self.errors = []
+        self.failures = []
+        self.unchanged = []
+        self._lock = Lock()
+
+    def _put(self, queue, item):
+        """Put the item on the queue unless the pipeline is aborted."""
+        while not self.abort.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get(self, queue):
+        """Get the next item from the queue or done if the pipeline is aborted."""
+        while not self.abort.is_set():
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                continue
+        return _DONE
+
+    def _stage(self, metrics, target, args):
+        """Run the stage target with the job metrics and abort the pipeline on errors."""
+        try:
+            with activate(metrics):
+                target(*args)
+        except Exception as ex:  # pylint: disable=broad-except
+            with self._lock:
+                self.errors.append(ex)
+            self.abort.set()
+
+    def fetch(self, job, query, out_queue):
+        """Stream chunks of objects from the query to the render queue."""
+        render_cls = SearchRender.get_render_class(job['object'])
+        with thread_connection(metadata_db(), reuse=False):
+            objs = render_cls.stream_objects(query)
+            start = time()
+            for chunk in SearchRender.chunk_objects(job['object'], objs, job['exclude']):
+                self.stats['fetch'].record(len(chunk), time() - start, out_queue.qsize())
+                if not self._put(out_queue, chunk):
+                    return
+                start = time()
+
+    def render(self, job, in_queue, out_queue):
+        """Render the chunks of objects to chunks of bulk actions."""
+        render_cls = SearchRender.document_render_class(job['object'], job.get('files_as_docs', False))
+        unchanged = UnchangedFilter(self.cli) if job.get('skip_unchanged') else None
+        with render_memo(), thread_connection(metadata_db(), reuse=False):
+            depth = in_queue.qsize()
+            chunk = self._get(in_queue)
+            while chunk is not _DONE:
+                start = time()
+                actions = SearchRender.generate_chunk(job['object'], render_cls, chunk, job.get('rebuild_index'))
+                if unchanged is not None:
+                    actions = list(unchanged.filter(iter(actions)))
+                self.stats['render'].record(len(chunk), time() - start, depth)
+                if not self._put(out_queue, actions):
+                    return
+                depth = in_queue.qsize()
+                chunk = self._get(in_queue)
+        if unchanged is not None:
+            with self._lock:
+                self.unchanged.append(unchanged)
+
+    def upload(self, in_queue):
+        """Upload the chunks of bulk actions."""
+        # pylint: disable=cyclic-import,import-outside-toplevel
+        from .search_sync import bulk_upload
+        # pylint: enable=cyclic-import
+        depth = in_queue.qsize()
+        actions = self._get(in_queue)
+        while actions is not _DONE:
+            start = time()
+            failures = bulk_upload(self.cli, iter(actions))
+            self.stats['upload'].record(len(actions), time() - start, depth)
+            with self._lock:
+                self.failures.extend(failures)
+            depth = in_queue.qsize()
+            actions = self._get(in_queue)
+
+    @staticmethod
+    def _start(threads):
+        """Start the threads and return them."""
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+    def _finish(self, threads, queue, consumers):
+        """Wait for the threads then tell the consumers of the queue they are done."""
+        for thread in threads:
+            thread.join()
+        for _i in range(consumers):
+            self._put(queue, _DONE)
+
+    def run(self, job):
+        """Run the pipeline for the job and return the list of failed items."""
+        queue_size = get_config().getint('elasticsearch', 'pipeline_queue_size')
+        render_queue = Queue(queue_size)
+        upload_queue = Queue(queue_size)
+        metrics = current_metrics()
+        start = time()
+        fetch_threads = self._start([
+            Thread(target=self._stage, args=(metrics, self.fetch, (job, query, render_queue)))
+            for query in fetch_queries(job, self.workers['fetch'])
+        ])
+        render_threads = self._start([
+            Thread(target=self._stage, args=(metrics, self.render, (job, render_queue, upload_queue)))
+            for _i in range(self.workers['render'])
+        ])
+        upload_threads = self._start([
+            Thread(target=self._stage, args=(metrics, self.upload, (upload_queue,)))
+            for _i in range(self.workers['upload'])
+        ])
+        self._finish(fetch_threads, render_queue, self.workers['render'])
+        self._finish(render_threads, upload_queue, self.workers['upload'])
+        self._finish(upload_threads, None, 0)
+        self.print_stats(job, time() - start)
+        if metrics is not None:
+            metrics.set_stages({
+                'select': self.stats['fetch'].busy,
+                'render': self.stats['render'].busy,
+                'upload': self.stats['upload'].busy
+            })
+        if self.errors:
+            raise self.errors[0]
+        for unchanged in self.unchanged:
+            unchanged.save(self.failures)
+        return self.failures
+
+    def print_stats(self, job, elapsed):
+        """Print the stage statistics for the job."""
+        for name in STAGES:
+            print(
+                'Pipeline {object} ({time_field}): {page} {stage} {items} items {items_per_second}/s '
+                'busy {busy_seconds}s of {elapsed}s queue avg {avg_queue_depth} max {max_queue_depth}'.format(
+                    elapsed=round(elapsed, 3), **dict(job, **self.stats[name].to_hash())
+                )
+            )
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Process pool work queue interface."""
+from __future__ import absolute_import
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from tqdm import tqdm
+from .connections import configure_db_pool, metadata_db
+from .instrumentation import RUN_METRICS
+from .profiler import QUERY_PROFILER
+from .render.base import open_render_memo
+
+_WORKER = {}
+
+
+# Coverage doesn't follow the worker processes.
+def init_worker(profile_queries, job_connections):  # pragma: no cover
+    """Size the connection pools, create the elasticsearch client and open the render memo for the worker process."""
+    # pylint: disable=cyclic-import,import-outside-toplevel
+    from .search_sync import es_client
+    # pylint: enable=cyclic-import
+    db_connections, es_connections = job_connections
+    configure_db_pool(metadata_db(), db_connections)
+    _WORKER['cli'] = es_client(es_connections)
+    # the worker process lasts for the sync run and so does its render memo
+    open_render_memo()
+    if profile_queries:
+        QUERY_PROFILER.install(metadata_db())
+
+
+def work_on_job(job):  # pragma: no cover
+    """Work on a job in the worker process and return success, the job metrics and query stats."""
+    # pylint: disable=cyclic-import,import-outside-toplevel
+    from .search_sync import try_doing_work
+    # pylint: enable=cyclic-import
+    return try_doing_work(_WORKER['cli'], job), RUN_METRICS.drain(), QUERY_PROFILER.drain()
+
+
+class ProcessQueue:
+    """
+    Class to implement the queue interface with a process pool.
+
+    The worker processes are spawned instead of forked so each one
+    opens its own database connection and elasticsearch client.
+    """
+
+    def __init__(self, processes, profile_queries=0, job_connections=(1, 1)):
+        """Create the process pool."""
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_context('spawn'),
+            initializer=init_worker,
+            initargs=(profile_queries, job_connections)
+        )
+        self.jobs = {}
+
+    def put(self, job_dict):
+        """Submit the job dictionary to the process pool."""
+        job_dict.pop('num_pages')
+        self.jobs[self.executor.submit(work_on_job, job_dict)] = job_dict
+
+    def progress(self, _args, checkpoint):
+        """
+        Display progress as jobs complete and return overall success.
+
+        The jobs not started yet are cancelled and the worker processes
+        are shut down even if a job raises.
+        """
+        success = True
+        try:
+            for future in tqdm(as_completed(self.jobs), total=len(self.jobs), desc='Total Completed'):
+                job_success, job_metrics, query_stats = future.result()
+                RUN_METRICS.extend(job_metrics)
+                QUERY_PROFILER.merge(query_stats)
+                checkpoint.page_done(self.jobs[future], job_success)
+                if not job_success:  # pragma: no cover failure testing is hard
+                    success = False
+        finally:
+            for future in self.jobs:
+                future.cancel()
+            self.executor.shutdown()
+        return success
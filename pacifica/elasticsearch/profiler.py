@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Attribute the SQL queries and their wall time to the render methods issuing them."""
+from __future__ import print_function
+import os
+import sys
+from threading import Lock
+from time import time
+
+PROFILER_FILE = os.path.abspath(__file__)
+PACKAGE_DIR = os.path.dirname(PROFILER_FILE)
+RENDER_DIR = os.path.join(PACKAGE_DIR, 'render')
+GENERIC_RENDER_FILES = ['__init__.py', 'base.py', 'cache.py', 'prefetch.py']
+
+
+def frame_module(frame):
+    """Return the module name of the frame."""
+    return os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+
+
+def frame_render_class(frame):
+    """Return the render class the frame is working for or None."""
+    for name in ['cls', 'render_cls']:
+        value = frame.f_locals.get(name)
+        if isinstance(value, type) and hasattr(value, 'render_type'):
+            return value
+    return None
+
+
+def query_caller(frame):
+    """
+    Return the name of the method issuing the query from the frame up.
+
+    The first method in a render module wins. Queries issued from the
+    shared render helpers go to the render class they work for with
+    the helper (or prefetch) name and anything else to the first
+    function in this package.
+    """
+    helper = None
+    render_caller = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PACKAGE_DIR) and filename != PROFILER_FILE:
+            render_cls = frame_render_class(frame)
+            in_render = os.path.dirname(filename) == RENDER_DIR
+            # comprehensions and lambdas are named after the method around them
+            if in_render and os.path.basename(filename) not in GENERIC_RENDER_FILES \
+                    and not frame.f_code.co_name.startswith('<'):
+                return '{}.{}'.format(getattr(render_cls, '__name__', frame_module(frame)), frame.f_code.co_name)
+            if helper is None:
+                helper = frame
+            if render_caller is None and render_cls is not None:
+                helper_name = 'prefetch' if frame_module(helper) == 'prefetch' else helper.f_code.co_name
+                render_caller = '{}.{}'.format(render_cls.__name__, helper_name)
+        frame = frame.f_back
+    if render_caller is not None:
+        return render_caller
+    if helper is not None:
+        return '{}.{}'.format(frame_module(helper), helper.f_code.co_name)
+    return 'other'
+
+
+class QueryProfiler:
+    """
+    Thread safe query counts and wall time for each calling method.
+
+    Installing the profiler wraps the execute method of the database so
+    every statement is timed and attributed from the stack that issued
+    it.
+    """
+
+    def __init__(self):
+        """Start with no queries."""
+        self._lock = Lock()
+        self.stats = {}
+        self.database = None
+
+    def install(self, database):
+        """Wrap the execute method of the database once."""
+        if self.database is database:
+            return
+        self.database = database
+        execute_sql = database.execute_sql
+
+        def profiled_execute_sql(*args, **kwargs):
+            """Execute the statement and record the time for the caller."""
+            start = time()
+            try:
+                return execute_sql(*args, **kwargs)
+            finally:
+                self.record(query_caller(sys._getframe(1)), time() - start)  # pylint: disable=protected-access
+        database.execute_sql = profiled_execute_sql
+
+    def record(self, caller, seconds):
+        """Record a query of the caller taking seconds."""
+        with self._lock:
+            stats = self.stats.setdefault(caller, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def merge(self, stats):
+        """Add the stats from another profiler."""
+        with self._lock:
+            for caller, (queries, seconds, max_seconds) in stats.items():
+                mine = self.stats.setdefault(caller, [0, 0.0, 0.0])
+                mine[0] += queries
+                mine[1] += seconds
+                mine[2] = max(mine[2], max_seconds)
+
+    def drain(self):
+        """Return and forget the stats."""
+        with self._lock:
+            stats, self.stats = self.stats, {}
+            return stats
+
+    def print_top(self, limit):
+        """Print the callers spending the most time in queries."""
+        stats = self.drain()
+        total = sum(caller_stats[1] for caller_stats in stats.values()) or 1.0
+        print('{:>10} {:>6} {:>9} {:>10} {:>10}  {}'.format('seconds', '%', 'queries', 'avg ms', 'max ms', 'caller'))
+        for caller, (queries, seconds, max_seconds) in sorted(
+                stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]:
+            print('{:>10.3f} {:>6.1f} {:>9} {:>10.2f} {:>10.2f}  {}'.format(
+                seconds, 100 * seconds / total, queries, 1000 * seconds / queries, 1000 * max_seconds, caller
+            ))
+
+
+QUERY_PROFILER = QueryProfiler()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Full reindex into a new versioned index swapped in behind the index alias."""
+from __future__ import print_function
+from datetime import datetime
+from .config import get_config
+from .search_render import ELASTIC_INDEX
+
+BULK_LOAD_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
+
+class IndexRebuild:
+    """
+    Build a new versioned index and point the index alias at it.
+
+    The new index is created from the mapping with refreshes and
+    replicas turned off for the bulk load. Once every page is indexed
+    the settings of the live index are restored, the segments are
+    merged and the alias is moved from the old indexes to the new one
+    in a single atomic request. The old versioned indexes are kept for
+    rollback, a plain index named like the alias is deleted in the same
+    request since the alias can not be created next to it.
+    """
+
+    def __init__(self, cli, alias=ELASTIC_INDEX, version=None):
+        """Save the client and name the new index after the alias and version."""
+        self.cli = cli
+        self.alias = alias
+        self.index = '{}_{}'.format(alias, version or datetime.now().strftime('%Y%m%d%H%M%S'))
+
+    def live_indexes(self):
+        """Return the indexes behind the alias and whether the alias name is a plain index."""
+        resp = self.cli.indices.get(index=self.alias, ignore=404)
+        if 'error' in resp:
+            return [], False
+        return sorted(resp), self.alias in resp
+
+    def live_settings(self):
+        """Return the refresh interval and replicas of the live index or None to reset them to the defaults."""
+        names = ['index.{}'.format(setting) for setting in BULK_LOAD_SETTINGS]
+        resp = self.cli.indices.get_settings(index=self.alias, name=names, flat_settings=True, ignore=404)
+        settings = dict.fromkeys(BULK_LOAD_SETTINGS)
+        if 'error' in resp:
+            return settings
+        for index, index_settings in resp.items():
+            if not isinstance(index_settings, dict) or 'settings' not in index_settings:
+                raise ValueError('Unexpected settings of {} behind {}: {}'.format(index, self.alias, index_settings))
+            for name in BULK_LOAD_SETTINGS:
+                settings[name] = index_settings['settings'].get('index.{}'.format(name), settings[name])
+        return settings
+
+    def create(self, params):
+        """Create the new index with the mapping params and the bulk load settings."""
+        # pylint: disable=unexpected-keyword-arg
+        self.cli.indices.create(
+            index=self.index,
+            include_type_name=True,
+            body={'settings': {'index': BULK_LOAD_SETTINGS}, 'mappings': {'doc': params}}
+        )
+        # pylint: enable=unexpected-keyword-arg
+        print('Rebuilding {} into {}'.format(self.alias, self.index))
+        return self.index
+
+    def finish(self):
+        """
+        Restore the settings, merge the segments and swap the alias to the new index.
+
+        The settings of the live index are read first so an unexpected
+        response fails the rebuild before the alias is touched.
+        """
+        settings = self.live_settings()
+        self.cli.indices.put_settings(index=self.index, body={'index': settings})
+        self.cli.indices.refresh(index=self.index)
+        self.cli.indices.forcemerge(
+            index=self.index,
+            max_num_segments=get_config().getint('elasticsearch', 'rebuild_max_num_segments'),
+            request_timeout=get_config().getint('elasticsearch', 'rebuild_timeout')
+        )
+        old_indexes, plain_index = self.live_indexes()
+        actions = [{'add': {'index': self.index, 'alias': self.alias}}]
+        if plain_index:
+            print('Removing the plain index {} to replace it with the alias'.format(self.alias))
+            actions.append({'remove_index': {'index': self.alias}})
+        else:
+            actions.extend({'remove': {'index': index, 'alias': self.alias}} for index in old_indexes)
+        self.cli.indices.update_aliases(body={'actions': actions})
+        print('Swapped {} to {}'.format(self.alias, self.index))
+        for index in old_indexes:
+            if index != self.alias:
+                print('Kept previous index {} for rollback'.format(index))
@@ -1,16 +1,63 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search base class has some common data and logic."""
-from functools import lru_cache, wraps
+from contextlib import contextmanager
+from functools import reduce, wraps
+from operator import or_
+from threading import Lock
+from playhouse.postgres_ext import PostgresqlExtDatabase, ServerSide
+from six import text_type
 from pacifica.metadata.rest.objectinfo import ObjectInfoAPI
 from pacifica.metadata.orm import Relationships
 from ..config import get_config
+from ..instrumentation import count
+from .cache import CACHE_STATS, TABLE_GENERATIONS, MemoryCache, cache_enabled, cache_key, get_cache
+from .prefetch import prefetch_context, prefetch_lookup, release_lookup, user_release_lookup
 
+_RENDER_MEMO = {'lock': Lock(), 'docs': None}
 
-_LRU_GLOBAL_ARGS = {
-    'maxsize': get_config().getint('elasticsearch', 'cache_size'),
-    'typed': False
-}
+
+def keyset_range(query, id_low, id_high):
+    """Restrict the query to primary keys in the range (id_low, id_high]."""
+    # pylint: disable=protected-access
+    primary_key = query.model._meta.primary_key
+    # pylint: enable=protected-access
+    if id_low is not None:
+        query = query.where(primary_key > id_low)
+    return query.where(primary_key <= id_high)
+
+
+def keyset_boundaries(query, items_per_page):
+    """Scan the primary keys of the query and yield the upper bound of each page."""
+    # pylint: disable=protected-access
+    primary_key = query.model._meta.primary_key
+    # pylint: enable=protected-access
+    obj_id = None
+    for index, (obj_id,) in enumerate(query.select(primary_key).tuples().iterator(), 1):
+        if index % items_per_page == 0:
+            yield obj_id
+            obj_id = None
+    if obj_id is not None:
+        yield obj_id
+
+
+def stream_query(query):
+    """Iterate over the query with a server side cursor if the database supports it."""
+    # pylint: disable=protected-access
+    if isinstance(query.model._meta.database, PostgresqlExtDatabase):
+        return ServerSide(query)
+    # pylint: enable=protected-access
+    return query.iterator()
+
+
+def union_select_query(obj_cls, changed_id_queries):
+    """Return the query for objects with a primary key in any of the changed id queries."""
+    # pylint: disable=protected-access
+    primary_key = obj_cls._meta.primary_key
+    # pylint: enable=protected-access
+    return (obj_cls.select()
+            .where(primary_key.in_(reduce(or_, changed_id_queries)))
+            .order_by(primary_key))
 
 
 def query_select_default_args(class_method):
@@ -20,7 +67,12 @@ def query_select_default_args(class_method):
         page = kwargs.pop('page', 0)
         items_per_page = kwargs.pop('items_per_page', 20)
         enable_paging = kwargs.pop('enable_paging', True)
+        keyset_paging = 'id_high' in kwargs
+        id_low = kwargs.pop('id_low', None)
+        id_high = kwargs.pop('id_high', None)
         query = class_method(*args, **kwargs)
+        if keyset_paging:
+            return keyset_range(query, id_low, id_high)
         if enable_paging:
             return query.paginate(page, items_per_page)
         return query
@@ -28,28 +80,128 @@ def query_select_default_args(class_method):
 
 
 def search_lru_cache(func):
-    """Wrap a function with my lru cache args."""
-    @lru_cache(**_LRU_GLOBAL_ARGS)
+    """Wrap a class method with the configured cache ignoring the class argument."""
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    def wrapper(cls, mdobject, **kwargs):
         """Calling inter function."""
-        return func(*args, **kwargs)
+        if not cache_enabled():
+            return func(cls, mdobject, **kwargs)
+        key = cache_key(mdobject, TABLE_GENERATIONS.get(mdobject), **kwargs)
+        ret = get_cache().get(key)
+        if ret is None:
+            CACHE_STATS.miss()
+            count('cache_misses')
+            ret = func(cls, mdobject, **kwargs)
+            get_cache().set(key, ret)
+        else:
+            CACHE_STATS.hit()
+            count('cache_hits')
+        return ret
     return wrapper
 
 
+def format_field(template, doc):
+    """Return a static field method rendering the object with the template."""
+    template = text_type(template)
+
+    def field(**obj):
+        return template.format_map(obj)
+    field.__doc__ = doc
+    field.template = template
+    return staticmethod(field)
+
+
+def compile_field(field):
+    """Return a function rendering the field from the object dictionary."""
+    template = getattr(field, 'template', None)
+    if template is not None:
+        return template.format_map
+    return lambda obj: field(**obj)
+
+
+def open_render_memo():
+    """Start the memo of rendered sub-documents shared by every thread unless one is open and return if it was."""
+    with _RENDER_MEMO['lock']:
+        if _RENDER_MEMO['docs'] is not None:
+            return False
+        _RENDER_MEMO['docs'] = MemoryCache(get_config().getint('elasticsearch', 'render_memo_size'), 0)
+        return True
+
+
+def close_render_memo():
+    """Drop the memo of rendered sub-documents."""
+    with _RENDER_MEMO['lock']:
+        _RENDER_MEMO['docs'] = None
+
+
+@contextmanager
+def render_memo():
+    """
+    Memoize the rendered sub-documents for the duration of the context.
+
+    The memo is shared by every thread and nested contexts use the
+    memo already open. The sync run opens it so the sub-documents are
+    rendered once per run, otherwise (i.e. in the celery workers) it
+    only lasts for the pages rendered in the context.
+    """
+    opened = open_render_memo()
+    try:
+        yield _RENDER_MEMO['docs']
+    finally:
+        if opened:
+            close_render_memo()
+
+
+class RelationshipUUID:  # pylint: disable=too-few-public-methods
+    """Class attribute resolving the uuid of the named relationship on first use."""
+
+    def __init__(self, name):
+        """Save the relationship name."""
+        self.name = name
+        self.uuid = None
+
+    def __get__(self, _obj, _cls):
+        """Query the uuid the first time it is used."""
+        if self.uuid is None:
+            self.uuid = str(Relationships.get(Relationships.name == self.name).uuid)
+        return self.uuid
+
+
 class SearchBase:
     """Search base class containing common data and logic."""
 
     fields = []
     rel_objs = []
+    prefetch_rels = []
+    release_sources = []
+    user_release_sources = []
+    files_summary_sources = []
     obj_type = 'unimplemented'
-    releaser_uuid = str(Relationships.get(Relationships.name == 'authorized_releaser').uuid)
-    search_required_uuid = str(Relationships.get(Relationships.name == 'search_required').uuid)
+    releaser_uuid = RelationshipUUID('authorized_releaser')
+    search_required_uuid = RelationshipUUID('search_required')
+    render_type = 'base'
+    field_renderers = ()
+    keyset_pageable = True
+
+    def __init_subclass__(cls, **kwargs):
+        """Compile the field renderers once for the render class."""
+        super().__init_subclass__(**kwargs)
+        if 'render_type' not in cls.__dict__:
+            cls.render_type = cls._cls_name_to_module(cls)
+        cls.field_renderers = tuple((key, compile_field(getattr(cls, key))) for key in cls.fields)
 
     @classmethod
     @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
+    def get_select_query(cls, time_delta, obj_cls, time_field, change_query='union'):
         """Return the select query based on kwargs provided."""
+        changed_id_queries = cls.changed_id_queries(time_delta, obj_cls, time_field)
+        if change_query == 'union' and changed_id_queries:
+            return union_select_query(obj_cls, changed_id_queries)
+        return cls.join_select_query(time_delta, obj_cls, time_field)
+
+    @classmethod
+    def join_select_query(cls, time_delta, obj_cls, time_field):
+        """Return the select query joining all the related objects."""
         # pylint: disable=protected-access
         return (obj_cls.select()
                 .where(getattr(obj_cls, time_field) > time_delta)
@@ -57,12 +209,68 @@ class SearchBase:
         # pylint: enable=protected-access
 
     @classmethod
-    @search_lru_cache
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of objects with changed related objects."""
+        # pylint: disable=unused-argument
+        return []
+
+    @classmethod
+    def object_class(cls):
+        """Return the metadata class of the rendered objects."""
+        return ObjectInfoAPI.get_class_object_from_name(cls.render_type)
+
+    @classmethod
+    def stream_objects(cls, query):
+        """Stream the objects of the query as dictionaries."""
+        return (obj.to_hash() for obj in stream_query(query))
+
+    @classmethod
+    def prefetch(cls, objs):
+        """Return a context prefetching the related objects for the page."""
+        return prefetch_context(objs, cls)
+
+    @classmethod
     def get_rel_by_args(cls, mdobject, **kwargs):
-        """Get the transaction user relationship."""
+        """Get the related objects from the prefetch context or the database."""
+        count('rel_lookups')
+        ret = prefetch_lookup(mdobject, kwargs)
+        if ret is None:
+            ret = cls._query_rel_by_args(mdobject, **kwargs)
+        else:
+            count('prefetch_hits')
+        return ret
+
+    @classmethod
+    @search_lru_cache
+    def _query_rel_by_args(cls, mdobject, **kwargs):
+        """Query the database for the related objects."""
         obj_cls = ObjectInfoAPI.get_class_object_from_name(mdobject)
         return [obj.to_hash() for obj in obj_cls.select().where(obj_cls.where_clause(kwargs))]
 
+    @classmethod
+    def release_status(cls, trans_id):
+        """Return whether the transaction is released and its DOI or None."""
+        ret = release_lookup(trans_id)
+        if ret is None:
+            ret = (False, None)
+            for trans_user_obj in cls.get_rel_by_args(
+                    'transaction_user', transaction=trans_id, relationship=cls.releaser_uuid):
+                ret = (True, None)
+                for doi_trans_obj in cls.get_rel_by_args('doi_transaction', transaction=trans_user_obj['uuid']):
+                    return (True, doi_trans_obj['doi'])
+        return ret
+
+    @classmethod
+    def user_released(cls, user_id):
+        """Return whether the user submitted a released transaction."""
+        ret = user_release_lookup(user_id)
+        if ret is None:
+            ret = False
+            for trans_id in cls._transsip_transsap_merge({'submitter': user_id}, '_id'):
+                if cls.get_rel_by_args('transaction_user', transaction=trans_id, relationship=cls.releaser_uuid):
+                    return True
+        return ret
+
     @classmethod
     def get_transactions(cls, **kwargs):  # pragma: no cover abstract method
         """Unimplemented in the base class."""
@@ -81,12 +289,25 @@ class SearchBase:
         """Convert the class name to the object type and module to load."""
         return rel_cls.__module__.split('.')[-1]
 
+    @classmethod
+    def render_memoized(cls, obj, render_rel_objs=False, render_trans_ids=False):
+        """Render the object once while the render memo is open and return it."""
+        docs = _RENDER_MEMO['docs']
+        if docs is None:
+            return cls.render(obj, render_rel_objs, render_trans_ids)
+        key = (cls.__name__, obj.get('_id'), obj.get('updated'), render_rel_objs, render_trans_ids)
+        ret = docs.get(key)
+        if ret is None:
+            ret = cls.render(obj, render_rel_objs, render_trans_ids)
+            docs.set(key, ret)
+        return ret
+
     @classmethod
     def render(cls, obj, render_rel_objs=False, render_trans_ids=False):
         """Render the object and return it."""
-        ret = {'type': cls._cls_name_to_module(cls)}
-        for key in cls.fields:
-            ret[key] = getattr(cls, key)(**obj)
+        ret = {'type': cls.render_type}
+        for key, field_renderer in cls.field_renderers:
+            ret[key] = field_renderer(obj)
         if render_rel_objs:
             for related_obj_name in cls.rel_objs:
                 ret[related_obj_name] = getattr(cls, '{}_obj_lists'.format(related_obj_name))(**obj)
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Cache backends for the related object lookups."""
+import operator
+import os
+import sqlite3
+from collections import OrderedDict
+from functools import lru_cache, reduce
+from json import dumps, loads
+from threading import Lock, local
+from time import time
+from peewee import Value, fn
+from pacifica.metadata.rest.objectinfo import ObjectInfoAPI
+from ..config import get_config
+
+
+class CacheStats:
+    """Thread safe hit and miss counters."""
+
+    def __init__(self):
+        """Start the counters at zero."""
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        """Count a cache hit."""
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        """Count a cache miss."""
+        with self._lock:
+            self.misses += 1
+
+    def to_hash(self):
+        """Return the counters as a dictionary."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class NullCache:
+    """Cache that never stores anything."""
+
+    @staticmethod
+    def get(_key):
+        """Always miss."""
+        return None
+
+    @staticmethod
+    def set(_key, _value):
+        """Drop the value."""
+
+
+class MemoryCache:
+    """Per process least recently used cache with an optional ttl."""
+
+    def __init__(self, maxsize, ttl):
+        """Create the empty cache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        """Return the number of values stored."""
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key):
+        """Return the value for key or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires and expires < time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store the value for key evicting the least recently used."""
+        with self._lock:
+            self._data[key] = (value, time() + self.ttl if self.ttl else 0)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SQLiteCache:
+    """Cache in a local SQLite file shared by processes on the host."""
+
+    def __init__(self, filename, ttl):
+        """Save the filename and ttl, connections are per thread."""
+        cache_dir = os.path.dirname(filename)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.filename = filename
+        self.ttl = ttl
+        self._local = local()
+
+    def _conn(self):
+        """Return the connection for this thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the value for key or None."""
+        row = self._conn().execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] and row[1] < time()):
+            return None
+        return loads(row[0])
+
+    def set(self, key, value):
+        """Store the value for key."""
+        self.set_many({key: value})
+
+    def get_many(self, keys):
+        """Return a dictionary of the values found for the keys."""
+        ret = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                ret[key] = value
+        return ret
+
+    def set_many(self, values):
+        """Store the dictionary of values in one transaction."""
+        expires = time() + self.ttl if self.ttl else 0
+        conn = self._conn()
+        conn.executemany(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            [(key, dumps(value), expires) for key, value in values.items()]
+        )
+        conn.commit()
+
+
+class RedisCache:
+    """Cache in a redis compatible server shared by every worker."""
+
+    def __init__(self, url, ttl):
+        """Connect to the redis server."""
+        # redis is an optional dependency only needed for this backend
+        # pylint: disable=import-outside-toplevel,import-error
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        """Return the value for key or None."""
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return loads(value)
+
+    def set(self, key, value):
+        """Store the value for key."""
+        self.client.set(key, dumps(value), ex=self.ttl or None)
+
+
+class TableGenerations:
+    """
+    Generation of the cached rows for each table.
+
+    The generation is part of the cache key so changing it drops every
+    cached row for the table. It is the latest updated or deleted time
+    of the table, read from the database the first time the table is
+    used and when invalidating, so processes sharing a cache backend
+    agree on it.
+    """
+
+    def __init__(self):
+        """Start with no tables."""
+        self._lock = Lock()
+        self.generations = {}
+
+    @staticmethod
+    def latest_query(mdobject, time_delta=None):
+        """Return the query for the table name with its latest updated and deleted time since time_delta."""
+        obj_cls = ObjectInfoAPI.get_class_object_from_name(mdobject)
+        query = obj_cls.select(Value(mdobject), fn.MAX(obj_cls.updated), fn.MAX(obj_cls.deleted))
+        if time_delta is not None:
+            query = query.where((obj_cls.updated > time_delta) | (obj_cls.deleted > time_delta))
+        return query
+
+    @staticmethod
+    def generation(last_updated, last_deleted):
+        """Return the generation for the latest times or None if nothing changed."""
+        if last_updated is None and last_deleted is None:
+            return None
+        return '{}/{}'.format(last_updated, last_deleted)
+
+    @classmethod
+    def latest(cls, mdobject, time_delta=None):
+        """Return the latest updated and deleted time of the table or None if nothing changed since time_delta."""
+        _mdobject, last_updated, last_deleted = cls.latest_query(mdobject, time_delta).tuples().get()
+        return cls.generation(last_updated, last_deleted)
+
+    def get(self, mdobject):
+        """Return the generation for the table reading it from the database on first use."""
+        with self._lock:
+            generation = self.generations.get(mdobject)
+        if generation is None:
+            generation = self.latest(mdobject) or ''
+            with self._lock:
+                generation = self.generations.setdefault(mdobject, generation)
+        return generation
+
+    def invalidate(self, mdobject, generation):
+        """Set a new generation for the table."""
+        with self._lock:
+            self.generations[mdobject] = generation
+
+    def invalidate_changed(self, time_delta):
+        """
+        Drop the cached rows for every table updated since time_delta.
+
+        Nothing is cached with the cache turned off, otherwise only the
+        tables with cached rows have a generation and they are checked
+        together in a single query.
+        """
+        with self._lock:
+            mdobjects = sorted(self.generations)
+        if not mdobjects or not cache_enabled():
+            return
+        query = reduce(operator.add, [self.latest_query(mdobject, time_delta) for mdobject in mdobjects])
+        for mdobject, last_updated, last_deleted in query.tuples():
+            generation = self.generation(last_updated, last_deleted)
+            if generation is not None:
+                self.invalidate(mdobject, generation)
+
+
+CACHE_STATS = CacheStats()
+TABLE_GENERATIONS = TableGenerations()
+
+
+@lru_cache(maxsize=1)
+def get_cache():
+    """Return the cache backend from the configuration."""
+    maxsize = get_config().getint('elasticsearch', 'cache_size')
+    ttl = get_config().getint('elasticsearch', 'cache_ttl')
+    backend = get_config().get('elasticsearch', 'cache_backend')
+    if not maxsize:
+        return NullCache()
+    if backend == 'sqlite':
+        return SQLiteCache(get_config().get('elasticsearch', 'cache_url'), ttl)
+    if backend == 'redis':
+        return RedisCache(get_config().get('elasticsearch', 'cache_url'), ttl)
+    return MemoryCache(maxsize, ttl)
+
+
+def cache_enabled():
+    """Return whether the configured cache backend stores anything."""
+    return not isinstance(get_cache(), NullCache)
+
+
+def cache_key(*args, **kwargs):
+    """Return a string key for the arguments."""
+    return dumps([args, sorted(kwargs.items())], default=str)
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
 from six import text_type
-from .base import SearchBase
+from .base import SearchBase, format_field
 
 
 class FilesRender(SearchBase):
@@ -14,68 +14,24 @@ class FilesRender(SearchBase):
         'updated_date', 'created_date'
     ]
 
-    @staticmethod
-    def obj_id(**file_obj):
-        """Return string for object id."""
-        return text_type('files_{_id}').format(**file_obj)
-
-    @staticmethod
-    def updated_date(**file_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**file_obj)
-
-    @staticmethod
-    def created_date(**file_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**file_obj)
-
-    @staticmethod
-    def display_name(**file_obj):
-        """Return the string to render display_name."""
-        return text_type('{subdir}/{name}').format(**file_obj)
-
-    @staticmethod
-    def mtime(**file_obj):
-        """Return the string to render mtime."""
-        return text_type('{mtime}').format(**file_obj)
-
-    @staticmethod
-    def ctime(**file_obj):
-        """Return the string to render mtime."""
-        return text_type('{ctime}').format(**file_obj)
-
-    @staticmethod
-    def name(**file_obj):
-        """Return the string to render mtime."""
-        return text_type('{name}').format(**file_obj)
-
-    @staticmethod
-    def subdir(**file_obj):
-        """Return the string to render mtime."""
-        return text_type('{subdir}').format(**file_obj)
-
-    @staticmethod
-    def size(**file_obj):
-        """Return the string to render size."""
-        return text_type('{size}').format(**file_obj)
-
-    @staticmethod
-    def hashsum(**file_obj):
-        """Return the string to render hashsum."""
-        return text_type('{hashsum}').format(**file_obj)
-
-    @staticmethod
-    def hashtype(**file_obj):
-        """Return the string to render hashtype."""
-        return text_type('{hashtype}').format(**file_obj)
+    obj_id = format_field('files_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{subdir}/{name}', 'Return the string to render display_name.')
+    mtime = format_field('{mtime}', 'Return the string to render mtime.')
+    ctime = format_field('{ctime}', 'Return the string to render ctime.')
+    name = format_field('{name}', 'Return the string to render name.')
+    subdir = format_field('{subdir}', 'Return the string to render subdir.')
+    size = format_field('{size}', 'Return the string to render size.')
+    hashsum = format_field('{hashsum}', 'Return the string to render hashsum.')
+    hashtype = format_field('{hashtype}', 'Return the string to render hashtype.')
 
     @staticmethod
     def keyword(**file_obj):
         """Return the rendered string for keywords."""
         return text_type(' ').join(text_type('{subdir}/{name}').format(**file_obj).split('/'))
 
-    # this is needed because it is abastract but it's never called
     @classmethod
-    def get_transactions(cls, **_kwargs):  # pragma: no cover
-        """Just return empty for this."""
-        return []
+    def get_transactions(cls, **file_obj):
+        """Return the transaction the file belongs to."""
+        return [text_type('transactions_{transaction}').format(**file_obj)]
@@ -1,10 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
 from peewee import JOIN
 from pacifica.metadata.orm import Groups, Instruments, InstrumentGroup
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 from .instruments import InstrumentsRender
 
 
@@ -19,10 +18,13 @@ class GroupsRender(SearchBase):
     rel_objs = [
         'instruments'
     ]
+    prefetch_rels = [
+        ('instrument_group', 'group', ['_id']),
+        ('instruments', '_id', ['instrument_group.instrument'])
+    ]
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
+    def join_select_query(cls, time_delta, obj_cls, time_field):
         """Generate the select query for groups related to instruments."""
         return (
             Groups.select()
@@ -36,30 +38,22 @@ class GroupsRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**group_obj):
-        """Return string for object id."""
-        return text_type('groups_{_id}').format(**group_obj)
-
-    @staticmethod
-    def updated_date(**group_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**group_obj)
-
-    @staticmethod
-    def created_date(**group_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**group_obj)
-
-    @staticmethod
-    def display_name(**group_obj):
-        """Return the string to render display_name."""
-        return text_type('{display_name}').format(**group_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of groups with changed related objects."""
+        return [
+            Groups.select(Groups.id).where(getattr(Groups, time_field) > time_delta),
+            InstrumentGroup.select(InstrumentGroup.group).where(getattr(InstrumentGroup, time_field) > time_delta),
+            (InstrumentGroup.select(InstrumentGroup.group)
+             .join(Instruments, on=(Instruments.id == InstrumentGroup.instrument))
+             .where(getattr(Instruments, time_field) > time_delta))
+        ]
 
-    @staticmethod
-    def keyword(**group_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{name}').format(**group_obj)
+    obj_id = format_field('groups_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{display_name}', 'Return the string to render display_name.')
+    keyword = format_field('{name}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **_group_obj):
@@ -75,7 +69,7 @@ class GroupsRender(SearchBase):
     def instruments_obj_lists(cls, **group_obj):
         """Get the instruments related to the group."""
         return [
-            InstrumentsRender.render(
+            InstrumentsRender.render_memoized(
                 cls.get_rel_by_args('instruments', _id=inst_group_obj['instrument'])[0]
             ) for inst_group_obj in cls.get_rel_by_args('instrument_group', group=group_obj['_id'])
         ]
@@ -1,11 +1,10 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
 from peewee import JOIN
 from pacifica.metadata.orm import Institutions, InstitutionUser, Transactions, Users, TransSIP, TransSAP
 from .users import UsersRender
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 
 
 class InstitutionsRender(SearchBase):
@@ -15,10 +14,14 @@ class InstitutionsRender(SearchBase):
         'obj_id', 'display_name', 'keyword', 'release',
         'updated_date', 'created_date'
     ]
+    prefetch_rels = [
+        ('institution_user', 'institution', ['_id']),
+        ('transsip', 'submitter', ['institution_user.user']),
+        ('transsap', 'submitter', ['institution_user.user'])
+    ]
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
+    def join_select_query(cls, time_delta, obj_cls, time_field):
         """Generate the select query for groups related to instruments."""
         # pylint: disable=invalid-name
         SIPTrans = Transactions.alias()
@@ -44,30 +47,37 @@ class InstitutionsRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**inst_obj):
-        """Return string for object id."""
-        return text_type('institutions_{_id}').format(**inst_obj)
-
-    @staticmethod
-    def updated_date(**inst_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**inst_obj)
-
-    @staticmethod
-    def created_date(**inst_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**inst_obj)
-
-    @staticmethod
-    def display_name(**inst_obj):
-        """Return the string to render display_name."""
-        return text_type('{name}').format(**inst_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of institutions with changed related objects."""
+        return [
+            Institutions.select(Institutions.id).where(getattr(Institutions, time_field) > time_delta),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .where(getattr(InstitutionUser, time_field) > time_delta)),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .join(Users, on=(InstitutionUser.user == Users.id))
+             .where(getattr(Users, time_field) > time_delta)),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .join(TransSIP, on=(TransSIP.submitter == InstitutionUser.user))
+             .where(getattr(TransSIP, time_field) > time_delta)),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .join(TransSAP, on=(TransSAP.submitter == InstitutionUser.user))
+             .where(getattr(TransSAP, time_field) > time_delta)),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .join(TransSIP, on=(TransSIP.submitter == InstitutionUser.user))
+             .join(Transactions, on=(Transactions.id == TransSIP.id))
+             .where(getattr(Transactions, time_field) > time_delta)),
+            (InstitutionUser.select(InstitutionUser.institution)
+             .join(TransSAP, on=(TransSAP.submitter == InstitutionUser.user))
+             .join(Transactions, on=(Transactions.id == TransSAP.id))
+             .where(getattr(Transactions, time_field) > time_delta))
+        ]
 
-    @staticmethod
-    def keyword(**inst_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{name}').format(**inst_obj)
+    obj_id = format_field('institutions_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{name}', 'Return the string to render display_name.')
+    keyword = format_field('{name}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **_inst_obj):
@@ -82,5 +92,5 @@ class InstitutionsRender(SearchBase):
             ret.update(UsersRender.get_transactions(_id=inst_user_obj['user']))
         return [
             'transactions_{}'.format(trans_id)
-            for trans_id in ret
+            for trans_id in sorted(ret)
         ]
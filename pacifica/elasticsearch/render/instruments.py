@@ -1,12 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
 from peewee import JOIN
 from pacifica.metadata.orm import Instruments, TransSIP, Keys, Values, InstrumentKeyValue
 from .keys import KeysRender
 from .values import ValuesRender
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 
 
 class InstrumentsRender(SearchBase):
@@ -17,10 +16,15 @@ class InstrumentsRender(SearchBase):
         'updated_date', 'created_date'
     ]
     rel_objs = ['key_value_pairs']
+    prefetch_rels = [
+        ('instrument_key_value', 'instrument', ['_id']),
+        ('keys', '_id', ['instrument_key_value.key']),
+        ('values', '_id', ['instrument_key_value.value']),
+        ('transsip', 'instrument', ['_id'])
+    ]
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
+    def join_select_query(cls, time_delta, obj_cls, time_field):
         """Generate the select query for groups related to instruments."""
         return (
             Instruments.select()
@@ -38,30 +42,27 @@ class InstrumentsRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**instrument_obj):
-        """Return string for object id."""
-        return text_type('instruments_{_id}').format(**instrument_obj)
-
-    @staticmethod
-    def updated_date(**instrument_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**instrument_obj)
-
-    @staticmethod
-    def created_date(**instrument_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**instrument_obj)
-
-    @staticmethod
-    def display_name(**instrument_obj):
-        """Return the string to render display_name."""
-        return text_type('{display_name}').format(**instrument_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of instruments with changed related objects."""
+        return [
+            Instruments.select(Instruments.id).where(getattr(Instruments, time_field) > time_delta),
+            (InstrumentKeyValue.select(InstrumentKeyValue.instrument)
+             .where(getattr(InstrumentKeyValue, time_field) > time_delta)),
+            (InstrumentKeyValue.select(InstrumentKeyValue.instrument)
+             .join(Keys, on=(InstrumentKeyValue.key == Keys.id))
+             .where(getattr(Keys, time_field) > time_delta)),
+            (InstrumentKeyValue.select(InstrumentKeyValue.instrument)
+             .join(Values, on=(InstrumentKeyValue.value == Values.id))
+             .where(getattr(Values, time_field) > time_delta)),
+            TransSIP.select(TransSIP.instrument).where(getattr(TransSIP, time_field) > time_delta)
+        ]
 
-    @staticmethod
-    def keyword(**instrument_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{display_name}').format(**instrument_obj)
+    obj_id = format_field('instruments_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{display_name}', 'Return the string to render display_name.')
+    keyword = format_field('{display_name}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **_instrument_obj):
@@ -84,8 +85,8 @@ class InstrumentsRender(SearchBase):
         for inst_kvp_obj in inst_kvp_objs:
             key_obj = cls.get_rel_by_args('keys', _id=inst_kvp_obj['key'])[0]
             value_obj = cls.get_rel_by_args('values', _id=inst_kvp_obj['value'])[0]
-            ret['key_objs'].append(KeysRender.render(key_obj))
-            ret['value_objs'].append(ValuesRender.render(value_obj))
+            ret['key_objs'].append(KeysRender.render_memoized(key_obj))
+            ret['value_objs'].append(ValuesRender.render_memoized(value_obj))
             ret['key_value_hash'][key_obj['key']] = value_obj['value']
         return ret
 
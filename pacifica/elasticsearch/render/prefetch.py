@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Page scoped prefetch of related objects for the render classes."""
+from threading import local
+from contextlib import contextmanager
+from six import text_type
+from peewee import JOIN, fn
+from pacifica.metadata.rest.objectinfo import ObjectInfoAPI
+from pacifica.metadata.orm import DOITransaction, Files, TransactionUser, TransSIP, TransSAP, Users
+from ..config import get_config
+
+_PREFETCH_LOCAL = local()
+
+
+def _chunks(values, chunk_size):
+    """Split the values into lists of at most chunk_size."""
+    values = list(values)
+    for index in range(0, len(values), chunk_size):
+        yield values[index:index + chunk_size]
+
+
+class PrefetchContext:
+    """
+    In memory indexes of related objects for a page of objects.
+
+    The indexes are keyed by (mdobject, key) and then by the string
+    value of the key so lookups look like the kwargs passed to
+    get_rel_by_args.
+    """
+
+    def __init__(self):
+        """Create empty indexes."""
+        self.loaded = {}
+        self.index = {}
+        self.rows = {}
+        self.release = {}
+        self.user_release = {}
+        self.files_summary = {}
+
+    def source_values(self, objs, source):
+        """Return the values for the source (`field` or `mdobject.field`)."""
+        if '.' in source:
+            src_mdobject, src_field = source.split('.')
+            objs = self.rows.get(src_mdobject, [])
+        else:
+            src_field = source
+        return set(obj[src_field] for obj in objs if obj.get(src_field) is not None)
+
+    def sources_values(self, objs, sources):
+        """Return the values for all the sources."""
+        values = set()
+        for source in sources:
+            values.update(self.source_values(objs, source))
+        return values
+
+    def load(self, mdobject, key, values):
+        """Load all mdobjects where key is in values into the indexes."""
+        obj_cls = ObjectInfoAPI.get_class_object_from_name(mdobject)
+        column = getattr(obj_cls, 'id' if key == '_id' else key)
+        loaded = self.loaded.setdefault((mdobject, key), set())
+        index = self.index.setdefault((mdobject, key), {})
+        rows = self.rows.setdefault(mdobject, [])
+        values = [value for value in values if text_type(value) not in loaded]
+        for chunk in _chunks(values, get_config().getint('elasticsearch', 'prefetch_chunk_size')):
+            query = obj_cls.select().where(obj_cls.where_clause({}) & (column << chunk))
+            for obj in query:
+                obj_hash = obj.to_hash()
+                index.setdefault(text_type(obj_hash[key]), []).append(obj_hash)
+                rows.append(obj_hash)
+            loaded.update(text_type(value) for value in chunk)
+
+    def load_release(self, trans_ids, releaser_uuid):
+        """Load the released flag and DOI of the transactions with one grouped query per chunk."""
+        trans_ids = [trans_id for trans_id in trans_ids if text_type(trans_id) not in self.release]
+        for chunk in _chunks(trans_ids, get_config().getint('elasticsearch', 'prefetch_chunk_size')):
+            self.release.update((text_type(trans_id), (False, None)) for trans_id in chunk)
+            query = (
+                TransactionUser.select(TransactionUser.transaction, fn.MAX(DOITransaction.doi))
+                .join(DOITransaction, JOIN.LEFT_OUTER, on=(
+                    (DOITransaction.transaction == TransactionUser.uuid) & DOITransaction.deleted.is_null()
+                ))
+                .where(
+                    TransactionUser.where_clause({'relationship': releaser_uuid}) &
+                    (TransactionUser.transaction << chunk)
+                )
+                .group_by(TransactionUser.transaction)
+            )
+            for trans_id, doi in query.tuples():
+                self.release[text_type(trans_id)] = (True, doi)
+
+    def load_user_release(self, user_ids, releaser_uuid):
+        """Load whether the users submitted a released transaction with one grouped query per chunk."""
+        user_ids = [user_id for user_id in user_ids if text_type(user_id) not in self.user_release]
+        released = [
+            trans_cls.select(trans_cls.id)
+            .join(TransactionUser, on=(TransactionUser.transaction == trans_cls.id))
+            .where(
+                trans_cls.where_clause({}) &
+                TransactionUser.where_clause({'relationship': releaser_uuid}) &
+                (trans_cls.submitter == Users.id)
+            )
+            for trans_cls in [TransSIP, TransSAP]
+        ]
+        for chunk in _chunks(user_ids, get_config().getint('elasticsearch', 'prefetch_chunk_size')):
+            self.user_release.update((text_type(user_id), False) for user_id in chunk)
+            query = Users.select(Users.id).where(
+                (Users.id << chunk) & (fn.EXISTS(released[0]) | fn.EXISTS(released[1]))
+            )
+            for (user_id,) in query.tuples():
+                self.user_release[text_type(user_id)] = True
+
+    def load_files_summary(self, trans_ids):
+        """Load the file count, size and subdirectories of the transactions with one grouped query per chunk."""
+        trans_ids = [trans_id for trans_id in trans_ids if text_type(trans_id) not in self.files_summary]
+        for chunk in _chunks(trans_ids, get_config().getint('elasticsearch', 'prefetch_chunk_size')):
+            self.files_summary.update(
+                (text_type(trans_id), {'count': 0, 'size': 0, 'subdirs': []}) for trans_id in chunk
+            )
+            query = (
+                Files.select(Files.transaction, Files.subdir, fn.COUNT(Files.id), fn.SUM(Files.size))
+                .where(Files.where_clause({}) & (Files.transaction << chunk))
+                .group_by(Files.transaction, Files.subdir)
+                .order_by(Files.transaction, Files.subdir)
+            )
+            for trans_id, subdir, files, size in query.tuples():
+                summary = self.files_summary[text_type(trans_id)]
+                summary['count'] += files
+                summary['size'] += int(size or 0)
+                summary['subdirs'].append(subdir)
+
+    def lookup(self, mdobject, kwargs):
+        """Return the prefetched list of objects or None if not loaded."""
+        for key, value in kwargs.items():
+            if text_type(value) not in self.loaded.get((mdobject, key), ()):
+                continue
+            ret = []
+            for obj in self.index[(mdobject, key)].get(text_type(value), []):
+                for other_key, other_value in kwargs.items():
+                    if other_key not in obj:
+                        return None
+                    if text_type(obj[other_key]) != text_type(other_value):
+                        break
+                else:
+                    ret.append(obj)
+            return ret
+        return None
+
+
+def release_lookup(trans_id):
+    """Lookup the released flag and DOI of the transaction in the active prefetch context."""
+    context = getattr(_PREFETCH_LOCAL, 'context', None)
+    if context is None:
+        return None
+    return context.release.get(text_type(trans_id))
+
+
+def user_release_lookup(user_id):
+    """Lookup whether the user released anything in the active prefetch context."""
+    context = getattr(_PREFETCH_LOCAL, 'context', None)
+    if context is None:
+        return None
+    return context.user_release.get(text_type(user_id))
+
+
+def files_summary_lookup(trans_id):
+    """Lookup the file aggregates of the transaction in the active prefetch context."""
+    context = getattr(_PREFETCH_LOCAL, 'context', None)
+    if context is None:
+        return None
+    return context.files_summary.get(text_type(trans_id))
+
+
+def prefetch_lookup(mdobject, kwargs):
+    """Lookup the mdobject in the active prefetch context for this thread."""
+    context = getattr(_PREFETCH_LOCAL, 'context', None)
+    if context is None:
+        return None
+    return context.lookup(mdobject, kwargs)
+
+
+@contextmanager
+def prefetch_context(objs, render_cls):
+    """
+    Prefetch the related objects of the render class for a page of objects.
+
+    The prefetch_rels of the render class are a list of (mdobject, key,
+    sources) where the sources are field names on the page objects or
+    `mdobject.field` of objects prefetched in a previous step. The
+    release_sources are the sources of transaction ids to resolve the
+    release status of, the user_release_sources the sources of user ids
+    to resolve whether they submitted a released transaction and the
+    files_summary_sources the sources of transaction ids to aggregate
+    the files of.
+    """
+    context = PrefetchContext()
+    for mdobject, key, sources in render_cls.prefetch_rels:
+        context.load(mdobject, key, context.sources_values(objs, sources))
+    trans_ids = context.sources_values(objs, render_cls.release_sources)
+    if trans_ids:
+        context.load_release(trans_ids, render_cls.releaser_uuid)
+    user_ids = context.sources_values(objs, render_cls.user_release_sources)
+    if user_ids:
+        context.load_user_release(user_ids, render_cls.releaser_uuid)
+    trans_ids = context.sources_values(objs, render_cls.files_summary_sources)
+    if trans_ids:
+        context.load_files_summary(trans_ids)
+    previous = getattr(_PREFETCH_LOCAL, 'context', None)
+    _PREFETCH_LOCAL.context = context
+    try:
+        yield context
+    finally:
+        _PREFETCH_LOCAL.context = previous
@@ -5,7 +5,7 @@ from six import text_type
 from peewee import JOIN
 from pacifica.metadata.orm import Projects, Users, ProjectUser, Relationships, Institutions, InstitutionUser
 from pacifica.metadata.orm import Instruments, ProjectInstrument, Groups, InstrumentGroup, TransSIP, TransSAP
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 from .users import UsersRender
 from .institutions import InstitutionsRender
 from .instruments import InstrumentsRender
@@ -26,11 +26,27 @@ class ProjectsRender(SearchBase):
         'users', 'institutions', 'instruments', 'groups',
         'released_count', 'science_themes'
     ]
+    prefetch_rels = [
+        ('projects', '_id', ['_id']),
+        ('project_user', 'project', ['_id']),
+        ('project_instrument', 'project', ['_id']),
+        ('users', '_id', ['project_user.user']),
+        ('transsip', 'project', ['_id']),
+        ('transsap', 'project', ['_id']),
+        ('relationships', 'uuid', ['project_user.relationship']),
+        ('institution_user', 'user', ['project_user.user']),
+        ('institutions', '_id', ['institution_user.institution']),
+        ('instrument_group', 'instrument', ['project_instrument.instrument']),
+        ('groups', '_id', ['instrument_group.group']),
+        ('instrument_group', 'group', ['groups._id']),
+        ('instruments', '_id', ['project_instrument.instrument', 'instrument_group.instrument'])
+    ]
+    release_sources = ['transsip._id', 'transsap._id']
+    user_release_sources = ['users._id']
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
-        """Return the select query based on kwargs provided."""
+    def join_select_query(cls, time_delta, obj_cls, time_field):
+        """Return the select query joining all the related objects."""
         return (
             Projects.select()
             .join(ProjectUser, JOIN.LEFT_OUTER, on=(ProjectUser.project == Projects.id))
@@ -60,61 +76,67 @@ class ProjectsRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**proj_obj):
-        """Return string for object id."""
-        return text_type('projects_{_id}').format(**proj_obj)
-
-    @staticmethod
-    def abstract(**proj_obj):
-        """Return string for the updated date."""
-        return text_type('{abstract}').format(**proj_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of projects with changed related objects."""
+        return [
+            Projects.select(Projects.id).where(getattr(Projects, time_field) > time_delta),
+            ProjectUser.select(ProjectUser.project).where(getattr(ProjectUser, time_field) > time_delta),
+            (ProjectUser.select(ProjectUser.project)
+             .join(Relationships, on=(Relationships.uuid == ProjectUser.relationship))
+             .where(getattr(Relationships, time_field) > time_delta)),
+            (ProjectUser.select(ProjectUser.project)
+             .join(InstitutionUser, on=(ProjectUser.user == InstitutionUser.user))
+             .where(getattr(InstitutionUser, time_field) > time_delta)),
+            (ProjectUser.select(ProjectUser.project)
+             .join(InstitutionUser, on=(ProjectUser.user == InstitutionUser.user))
+             .join(Institutions, on=(InstitutionUser.institution == Institutions.id))
+             .where(getattr(Institutions, time_field) > time_delta)),
+            TransSIP.select(TransSIP.project).where(getattr(TransSIP, time_field) > time_delta),
+            TransSAP.select(TransSAP.project).where(getattr(TransSAP, time_field) > time_delta),
+            (ProjectInstrument.select(ProjectInstrument.project)
+             .where(getattr(ProjectInstrument, time_field) > time_delta)),
+            (ProjectInstrument.select(ProjectInstrument.project)
+             .join(Instruments, on=(ProjectInstrument.instrument == Instruments.id))
+             .where(getattr(Instruments, time_field) > time_delta)),
+            (ProjectInstrument.select(ProjectInstrument.project)
+             .join(InstrumentGroup, on=(InstrumentGroup.instrument == ProjectInstrument.instrument))
+             .where(getattr(InstrumentGroup, time_field) > time_delta)),
+            (ProjectInstrument.select(ProjectInstrument.project)
+             .join(InstrumentGroup, on=(InstrumentGroup.instrument == ProjectInstrument.instrument))
+             .join(Groups, on=(InstrumentGroup.group == Groups.id))
+             .where(getattr(Groups, time_field) > time_delta))
+        ]
 
-    @staticmethod
-    def title(**proj_obj):
-        """Return string for the updated date."""
-        return text_type('{title}').format(**proj_obj)
+    obj_id = format_field('projects_{_id}', 'Return string for object id.')
+    abstract = format_field('{abstract}', 'Return string for the abstract.')
+    title = format_field('{title}', 'Return string for the title.')
 
     @staticmethod
     def actual_end_date(**proj_obj):
-        """Return string for the updated date."""
+        """Return string for the actual end date."""
         if not proj_obj.get('actual_end_date'):
             return None
         return text_type('{actual_end_date}').format(**proj_obj)
 
     @staticmethod
     def actual_start_date(**proj_obj):
-        """Return string for the updated date."""
+        """Return string for the actual start date."""
         if not proj_obj.get('actual_start_date'):
             return None
         return text_type('{actual_start_date}').format(**proj_obj)
 
     @staticmethod
     def closed_date(**proj_obj):
-        """Return string for the updated date."""
+        """Return string for the closed date."""
         if not proj_obj.get('closed_date'):
             return None
         return text_type('{closed_date}').format(**proj_obj)
 
-    @staticmethod
-    def updated_date(**proj_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**proj_obj)
-
-    @staticmethod
-    def display_name(**proj_obj):
-        """Return the string to render display_name."""
-        return text_type('{title}').format(**proj_obj)
-
-    @staticmethod
-    def created_date(**proj_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**proj_obj)
-
-    @staticmethod
-    def keyword(**proj_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{title}').format(**proj_obj)
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    display_name = format_field('{title}', 'Return the string to render display_name.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    keyword = format_field('{title}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **proj_obj):
@@ -124,20 +146,13 @@ class ProjectsRender(SearchBase):
             return 'true'
         return 'false'
 
-    @classmethod
-    def _transaction_release(cls, trans_id):
-        """Return 'true' if transaction has been release."""
-        # pylint: disable=import-outside-toplevel
-        # pylint: disable=cyclic-import
-        from .transactions import TransactionsRender
-        return TransactionsRender.release(_id=trans_id)
-
     @classmethod
     def released_count_obj_lists(cls, **proj_obj):
         """Count the released transactions associated with this project."""
         ret = 0
         for trans_id in cls._transsip_transsap_merge({'project': proj_obj['_id']}, '_id'):
-            if cls._transaction_release(trans_id) == 'true':
+            released, _doi = cls.release_status(trans_id)
+            if released:
                 ret += 1
         return ret
 
@@ -157,7 +172,7 @@ class ProjectsRender(SearchBase):
             for inst_obj in cls.get_rel_by_args('institution_user', user=proj_user_obj['user']):
                 ret.update([inst_obj['institution']])
         return [
-            InstitutionsRender.render(
+            InstitutionsRender.render_memoized(
                 cls.get_rel_by_args('institutions', _id=inst_id)[0]
             ) for inst_id in ret
         ]
@@ -166,7 +181,7 @@ class ProjectsRender(SearchBase):
     def instruments_obj_lists(cls, **proj_obj):
         """Get the instruments related to the transaction."""
         return [
-            InstrumentsRender.render(
+            InstrumentsRender.render_memoized(
                 cls.get_rel_by_args('instruments', _id=proj_inst_obj['instrument'])[0]
             ) for proj_inst_obj in cls.get_rel_by_args('project_instrument', project=proj_obj['_id'])
         ]
@@ -179,7 +194,7 @@ class ProjectsRender(SearchBase):
             for group_obj in cls.get_rel_by_args('instrument_group', instrument=proj_inst_obj['instrument']):
                 ret.update([group_obj['group']])
         return [
-            GroupsRender.render(
+            GroupsRender.render_memoized(
                 cls.get_rel_by_args('groups', _id=group_id)[0], True
             ) for group_id in ret
         ]
@@ -199,7 +214,7 @@ class ProjectsRender(SearchBase):
             rel_obj = cls.get_rel_by_args('relationships', uuid=proj_user_obj['relationship'])[0]
             rel_list = ret.get(rel_obj['name'], [])
             rel_list.append(
-                UsersRender.render(cls.get_rel_by_args('users', _id=proj_user_obj['user'])[0])
+                UsersRender.render_memoized(cls.get_rel_by_args('users', _id=proj_user_obj['user'])[0])
             )
             ret[rel_obj['name']] = rel_list
         return ret
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
 from six import text_type
-from .base import SearchBase
+from .base import SearchBase, format_field
 
 
 class RelationshipsRender(SearchBase):
@@ -13,30 +13,11 @@ class RelationshipsRender(SearchBase):
         'updated_date', 'created_date'
     ]
 
-    @staticmethod
-    def obj_id(**rel_obj):
-        """Return string for object id."""
-        return text_type('relationships_{uuid}').format(**rel_obj)
-
-    @staticmethod
-    def updated_date(**rel_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**rel_obj)
-
-    @staticmethod
-    def created_date(**rel_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**rel_obj)
-
-    @staticmethod
-    def display_name(**rel_obj):
-        """Return the string to render display_name."""
-        return text_type('{display_name}').format(**rel_obj)
-
-    @staticmethod
-    def keyword(**rel_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{display_name}').format(**rel_obj)
+    obj_id = format_field('relationships_{uuid}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{display_name}', 'Return the string to render display_name.')
+    keyword = format_field('{display_name}', 'Return the rendered string for keywords.')
 
     @classmethod
     def name(cls, **rel_obj):
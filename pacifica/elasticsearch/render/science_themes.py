@@ -1,42 +1,75 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
-from .base import SearchBase
+from peewee import fn
+from pacifica.metadata.orm import Projects
+from .base import SearchBase, format_field, query_select_default_args, stream_query
 
 
 class ScienceThemesRender(SearchBase):
-    """Render an science theme for search."""
+    """
+    Render an science theme for search.
+
+    Science themes are not a table, each theme is rendered once from
+    the projects having it with the latest updated and earliest created
+    dates of those projects.
+    """
 
     fields = [
         'obj_id', 'display_name', 'keyword',
         'updated_date', 'created_date', 'release'
     ]
+    keyset_pageable = False
+    prefetch_rels = [
+        ('projects', 'science_theme', ['science_theme']),
+        ('transsip', 'project', ['projects._id']),
+        ('transsap', 'project', ['projects._id'])
+    ]
 
-    @staticmethod
-    def updated_date(**proj_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**proj_obj)
-
-    @staticmethod
-    def obj_id(**proj_obj):
-        """Return string for object id."""
-        return text_type('science_themes_{science_theme}').format(**proj_obj)
+    @classmethod
+    def object_class(cls):
+        """Return the projects class the science themes come from."""
+        return Projects
 
-    @staticmethod
-    def created_date(**proj_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**proj_obj)
+    @classmethod
+    @query_select_default_args
+    def get_select_query(cls, time_delta, obj_cls, time_field, change_query='union'):
+        """Return the select query for the science themes of the changed projects."""
+        # pylint: disable=cyclic-import,import-outside-toplevel
+        from .projects import ProjectsRender
+        # pylint: enable=cyclic-import
+        # pylint: disable=unexpected-keyword-arg
+        changed_projects = ProjectsRender.get_select_query(
+            time_delta=time_delta, obj_cls=obj_cls, time_field=time_field,
+            enable_paging=False, change_query=change_query
+        ).select(Projects.science_theme)
+        # pylint: enable=unexpected-keyword-arg
+        return (
+            Projects.select(
+                Projects.science_theme,
+                fn.MAX(Projects.updated).alias('updated'),
+                fn.MIN(Projects.created).alias('created'))
+            .where(
+                Projects.deleted.is_null() &
+                Projects.science_theme.is_null(False) &
+                Projects.science_theme.in_(changed_projects))
+            .group_by(Projects.science_theme)
+            .order_by(Projects.science_theme)
+        )
 
-    @staticmethod
-    def display_name(**proj_obj):
-        """Return the string to render display_name."""
-        return text_type('{science_theme}').format(**proj_obj)
+    @classmethod
+    def stream_objects(cls, query):
+        """Stream the science themes as dictionaries like the other objects."""
+        for theme_obj in stream_query(query.dicts()):
+            for key in ['updated', 'created']:
+                theme_obj[key] = theme_obj[key].isoformat()
+            yield theme_obj
 
-    @staticmethod
-    def keyword(**proj_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{science_theme}').format(**proj_obj)
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    obj_id = format_field('science_themes_{science_theme}', 'Return string for object id.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{science_theme}', 'Return the string to render display_name.')
+    keyword = format_field('{science_theme}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **_proj_obj):
@@ -52,4 +85,4 @@ class ScienceThemesRender(SearchBase):
                 'transactions_{}'.format(trans_id)
                 for trans_id in cls._transsip_transsap_merge({'project': rel_proj_obj['_id']}, '_id')
             ])
-        return list(ret)
+        return sorted(ret)
@@ -1,8 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
-from peewee import DoesNotExist, JOIN
+from peewee import JOIN
 from pacifica.metadata.orm import DOITransaction, TransactionUser, Transactions, Users, Instruments, TransSIP
 from pacifica.metadata.orm import TransSAP, Groups, InstrumentGroup, Relationships, Files, Projects, Keys, Values
 from pacifica.metadata.orm import TransactionKeyValue
@@ -14,7 +13,7 @@ from .projects import ProjectsRender
 from .keys import KeysRender
 from .values import ValuesRender
 from .files import FilesRender
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 
 
 class TransactionsRender(SearchBase):
@@ -27,11 +26,27 @@ class TransactionsRender(SearchBase):
     rel_objs = [
         'users', 'instruments', 'groups', 'projects', 'key_value_pairs', 'files'
     ]
+    prefetch_rels = [
+        ('transsip', '_id', ['_id']),
+        ('transsap', '_id', ['_id']),
+        ('transaction_user', 'transaction', ['_id']),
+        ('files', 'transaction', ['_id']),
+        ('trans_key_value', 'transaction', ['_id']),
+        ('users', '_id', ['transsip.submitter', 'transsap.submitter', 'transaction_user.user']),
+        ('relationships', 'uuid', ['transaction_user.relationship']),
+        ('instruments', '_id', ['transsip.instrument']),
+        ('instrument_group', 'instrument', ['transsip.instrument']),
+        ('groups', '_id', ['instrument_group.group']),
+        ('projects', '_id', ['transsip.project', 'transsap.project']),
+        ('keys', '_id', ['trans_key_value.key']),
+        ('values', '_id', ['trans_key_value.value'])
+    ]
+    release_sources = ['_id']
+    user_release_sources = ['users._id']
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
-        """Return the select query based on kwargs provided."""
+    def join_select_query(cls, time_delta, obj_cls, time_field):
+        """Return the select query joining all the related objects."""
         # The alias() method does return a class
         # pylint: disable=invalid-name
         ReleaseUsers = Users.alias()
@@ -82,70 +97,90 @@ class TransactionsRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**trans_obj):
-        """Return string for object id."""
-        return text_type('transactions_{_id}').format(**trans_obj)
-
-    @staticmethod
-    def description(**trans_obj):
-        """Return string for the updated date."""
-        return text_type('{description}').format(**trans_obj)
-
-    @staticmethod
-    def updated_date(**trans_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**trans_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of transactions with changed related objects."""
+        return [
+            Transactions.select(Transactions.id).where(getattr(Transactions, time_field) > time_delta),
+            Files.select(Files.transaction).where(getattr(Files, time_field) > time_delta),
+            (TransactionKeyValue.select(TransactionKeyValue.transaction)
+             .where(getattr(TransactionKeyValue, time_field) > time_delta)),
+            (TransactionKeyValue.select(TransactionKeyValue.transaction)
+             .join(Keys, on=(TransactionKeyValue.key == Keys.id))
+             .where(getattr(Keys, time_field) > time_delta)),
+            (TransactionKeyValue.select(TransactionKeyValue.transaction)
+             .join(Values, on=(TransactionKeyValue.value == Values.id))
+             .where(getattr(Values, time_field) > time_delta)),
+            (TransactionUser.select(TransactionUser.transaction)
+             .where(getattr(TransactionUser, time_field) > time_delta)),
+            (TransactionUser.select(TransactionUser.transaction)
+             .join(DOITransaction, on=(DOITransaction.transaction == TransactionUser.uuid))
+             .where(getattr(DOITransaction, time_field) > time_delta)),
+            (TransactionUser.select(TransactionUser.transaction)
+             .join(Relationships, on=(Relationships.uuid == TransactionUser.relationship))
+             .where(getattr(Relationships, time_field) > time_delta)),
+            (TransactionUser.select(TransactionUser.transaction)
+             .join(Users, on=(TransactionUser.user == Users.id))
+             .where(getattr(Users, time_field) > time_delta)),
+            TransSIP.select(TransSIP.id).where(getattr(TransSIP, time_field) > time_delta),
+            TransSAP.select(TransSAP.id).where(getattr(TransSAP, time_field) > time_delta),
+            (TransSIP.select(TransSIP.id)
+             .join(Users, on=(TransSIP.submitter == Users.id))
+             .where(getattr(Users, time_field) > time_delta)),
+            (TransSAP.select(TransSAP.id)
+             .join(Users, on=(TransSAP.submitter == Users.id))
+             .where(getattr(Users, time_field) > time_delta)),
+            (TransSIP.select(TransSIP.id)
+             .join(Projects, on=(TransSIP.project == Projects.id))
+             .where(getattr(Projects, time_field) > time_delta)),
+            (TransSAP.select(TransSAP.id)
+             .join(Projects, on=(TransSAP.project == Projects.id))
+             .where(getattr(Projects, time_field) > time_delta)),
+            (TransSIP.select(TransSIP.id)
+             .join(Instruments, on=(TransSIP.instrument == Instruments.id))
+             .where(getattr(Instruments, time_field) > time_delta)),
+            (TransSIP.select(TransSIP.id)
+             .join(InstrumentGroup, on=(InstrumentGroup.instrument == TransSIP.instrument))
+             .where(getattr(InstrumentGroup, time_field) > time_delta)),
+            (TransSIP.select(TransSIP.id)
+             .join(InstrumentGroup, on=(InstrumentGroup.instrument == TransSIP.instrument))
+             .join(Groups, on=(InstrumentGroup.group == Groups.id))
+             .where(getattr(Groups, time_field) > time_delta))
+        ]
 
-    @staticmethod
-    def created_date(**trans_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**trans_obj)
+    obj_id = format_field('transactions_{_id}', 'Return string for object id.')
+    description = format_field('{description}', 'Return string for the description.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
 
     @classmethod
     def release(cls, **trans_obj):
         """Return 'true' if transaction has been release."""
-        predicate = ((TransactionUser.transaction == trans_obj['_id']) & (
-            TransactionUser.relationship == cls.releaser_uuid))
-        query = (TransactionUser.select().where(predicate))
-        try:
-            query.get()
-            ret = 'true'
-        except DoesNotExist:
-            ret = 'false'
-        return ret
+        released, _doi = cls.release_status(trans_obj['_id'])
+        return 'true' if released else 'false'
 
     @classmethod
     def access_url(cls, **trans_obj):
         """Figure out the access url for the transaction."""
-        trans_doi = cls.get_trans_doi(trans_obj['_id'])
-        if trans_doi != 'false':
-            trans_obj['doi'] = trans_doi
+        released, doi = cls.release_status(trans_obj['_id'])
+        if doi is not None:
+            trans_obj['doi'] = doi
             return get_config().get('policy', 'doi_url_format').format(**trans_obj)
-        if cls.release(**trans_obj) == 'true':
+        if released:
             return get_config().get('policy', 'release_url_format').format(**trans_obj)
         return get_config().get('policy', 'internal_url_format').format(**trans_obj)
 
     @classmethod
     def get_trans_doi(cls, trans_id):
         """Get the transaction doi or return false."""
-        preciate = (TransactionUser.uuid == DOITransaction.transaction)
-        where_clause = ((TransactionUser.relationship == cls.releaser_uuid) & (TransactionUser.transaction == trans_id))
-        # pylint: disable=no-member
-        query = (DOITransaction.select().join(TransactionUser, on=preciate).where(where_clause))
-        # pylint: enable=no-member
-        try:
-            ret = query.get().doi
-        except DoesNotExist:
-            ret = 'false'
-        return ret
+        _released, doi = cls.release_status(trans_id)
+        return 'false' if doi is None else doi
 
     @classmethod
     def has_doi(cls, **trans_obj):
         """Return boolean if the transaction has a DOI."""
-        if cls.get_trans_doi(trans_obj['_id']) != 'false':
-            return 'true'
-        return 'false'
+        _released, doi = cls.release_status(trans_obj['_id'])
+        return 'false' if doi is None else 'true'
 
     @classmethod
     def files_obj_lists(cls, **trans_obj):
@@ -161,13 +196,13 @@ class TransactionsRender(SearchBase):
         ret = {'submitter': []}
         for user_id in cls._transsip_transsap_merge({'_id': trans_obj['_id']}, 'submitter'):
             ret['submitter'].append(
-                UsersRender.render(cls.get_rel_by_args('users', _id=user_id)[0])
+                UsersRender.render_memoized(cls.get_rel_by_args('users', _id=user_id)[0])
             )
         for trans_user_obj in cls.get_rel_by_args('transaction_user', transaction=trans_obj['_id']):
             rel_obj = cls.get_rel_by_args('relationships', uuid=trans_user_obj['relationship'])[0]
             rel_list = ret.get(rel_obj['name'], [])
             rel_list.append(
-                UsersRender.render(cls.get_rel_by_args('users', _id=trans_user_obj['user'])[0])
+                UsersRender.render_memoized(cls.get_rel_by_args('users', _id=trans_user_obj['user'])[0])
             )
             ret[rel_obj['name']] = rel_list
         return ret
@@ -179,7 +214,7 @@ class TransactionsRender(SearchBase):
         for trans_obj in cls.get_rel_by_args('transsip', _id=trans_obj['_id']):
             ret.update([trans_obj['instrument']])
         return [
-            InstrumentsRender.render(
+            InstrumentsRender.render_memoized(
                 cls.get_rel_by_args('instruments', _id=inst_id)[0]
             ) for inst_id in ret
         ]
@@ -192,7 +227,7 @@ class TransactionsRender(SearchBase):
             for group_obj in cls.get_rel_by_args('instrument_group', instrument=inst_obj['instrument']):
                 ret.update([group_obj['group']])
         return [
-            GroupsRender.render(
+            GroupsRender.render_memoized(
                 cls.get_rel_by_args('groups', _id=group_id)[0]
             ) for group_id in ret
         ]
@@ -201,7 +236,7 @@ class TransactionsRender(SearchBase):
     def projects_obj_lists(cls, **trans_obj):
         """Get the projects related to the transaction."""
         return [
-            ProjectsRender.render(
+            ProjectsRender.render_memoized(
                 cls.get_rel_by_args('projects', _id=proj_id)[0]
             ) for proj_id in cls._transsip_transsap_merge({'_id': trans_obj['_id']}, 'project')
         ]
@@ -217,8 +252,8 @@ class TransactionsRender(SearchBase):
         for trans_kvp_obj in cls.get_rel_by_args('trans_key_value', transaction=trans_obj['_id']):
             key_obj = cls.get_rel_by_args('keys', _id=trans_kvp_obj['key'])[0]
             value_obj = cls.get_rel_by_args('values', _id=trans_kvp_obj['value'])[0]
-            ret['key_objs'].append(KeysRender.render(key_obj))
-            ret['value_objs'].append(ValuesRender.render(value_obj))
+            ret['key_objs'].append(KeysRender.render_memoized(key_obj))
+            ret['value_objs'].append(ValuesRender.render_memoized(value_obj))
             ret['key_value_hash'][key_obj['key']] = value_obj['value']
         return ret
 
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Search transaction rendering methods with files as separate documents."""
+from peewee import fn
+from pacifica.metadata.orm import Files
+from .prefetch import files_summary_lookup
+from .transactions import TransactionsRender
+
+
+class TransactionsSummaryRender(TransactionsRender):
+    """
+    Render a transaction with only file aggregates for search.
+
+    The files are synced as their own documents so the transaction
+    keeps the file count, total size and subdirectories instead of
+    every rendered file.
+    """
+
+    render_type = 'transactions'
+    rel_objs = TransactionsRender.rel_objs + ['files_summary']
+    prefetch_rels = [rel for rel in TransactionsRender.prefetch_rels if rel[0] != 'files']
+    files_summary_sources = ['_id']
+
+    @classmethod
+    def files_obj_lists(cls, **_trans_obj):
+        """Return no files so previously embedded files are removed."""
+        return []
+
+    @classmethod
+    def files_summary_obj_lists(cls, **trans_obj):
+        """Get the aggregates of the files in the transaction."""
+        ret = files_summary_lookup(trans_obj['_id'])
+        if ret is not None:
+            return ret
+        ret = {'count': 0, 'size': 0, 'subdirs': []}
+        query = (
+            Files.select(Files.subdir, fn.COUNT(Files.id), fn.SUM(Files.size))
+            .where(Files.where_clause({'transaction': trans_obj['_id']}))
+            .group_by(Files.subdir)
+            .order_by(Files.subdir)
+        )
+        for subdir, count, size in query.tuples():
+            ret['count'] += count
+            ret['size'] += int(size or 0)
+            ret['subdirs'].append(subdir)
+        return ret
@@ -1,10 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
 from peewee import JOIN
 from pacifica.metadata.orm import Users, TransSIP, TransSAP
-from .base import SearchBase, query_select_default_args
+from .base import SearchBase, format_field
 
 
 class UsersRender(SearchBase):
@@ -14,11 +13,15 @@ class UsersRender(SearchBase):
         'obj_id', 'display_name', 'keyword', 'release',
         'updated_date', 'created_date'
     ]
+    prefetch_rels = [
+        ('transsip', 'submitter', ['_id']),
+        ('transsap', 'submitter', ['_id'])
+    ]
+    user_release_sources = ['_id']
 
     @classmethod
-    @query_select_default_args
-    def get_select_query(cls, time_delta, obj_cls, time_field):
-        """Return the select query based on kwargs provided."""
+    def join_select_query(cls, time_delta, obj_cls, time_field):
+        """Return the select query joining all the related objects."""
         return (
             Users.select()
             .join(TransSIP, JOIN.LEFT_OUTER, on=(TransSIP.submitter == Users.id))
@@ -31,38 +34,29 @@ class UsersRender(SearchBase):
             .distinct()
         )
 
-    @staticmethod
-    def obj_id(**user_obj):
-        """Return string for object id."""
-        return text_type('users_{_id}').format(**user_obj)
-
-    @staticmethod
-    def updated_date(**user_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**user_obj)
-
-    @staticmethod
-    def created_date(**user_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**user_obj)
-
-    @staticmethod
-    def display_name(**user_obj):
-        """Return the string to render display_name."""
-        return text_type('{last_name}, {first_name} {middle_initial}').format(**user_obj)
+    @classmethod
+    def changed_id_queries(cls, time_delta, obj_cls, time_field):
+        """Return the queries selecting ids of users with changed related objects."""
+        return [
+            Users.select(Users.id).where(getattr(Users, time_field) > time_delta),
+            TransSIP.select(TransSIP.submitter).where(getattr(TransSIP, time_field) > time_delta),
+            TransSAP.select(TransSAP.submitter).where(getattr(TransSAP, time_field) > time_delta)
+        ]
 
-    @staticmethod
-    def keyword(**user_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{last_name}, {first_name} {middle_initial}').format(**user_obj)
+    obj_id = format_field('users_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field(
+        '{last_name}, {first_name} {middle_initial}', 'Return the string to render display_name.'
+    )
+    keyword = format_field(
+        '{last_name}, {first_name} {middle_initial}', 'Return the rendered string for keywords.'
+    )
 
     @classmethod
     def release(cls, **user_obj):
         """Return whether the user has released anything."""
-        for trans_id in cls._transsip_transsap_merge({'submitter': user_obj['_id']}, '_id'):
-            if cls.get_rel_by_args('transaction_user', transaction=trans_id, relationship=cls.releaser_uuid):
-                return 'true'
-        return 'false'
+        return 'true' if cls.user_released(user_obj['_id']) else 'false'
 
     @classmethod
     def get_transactions(cls, **user_obj):
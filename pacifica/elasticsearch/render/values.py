@@ -1,8 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Search transaction rendering methods."""
-from six import text_type
-from .base import SearchBase
+from .base import SearchBase, format_field
 
 
 class ValuesRender(SearchBase):
@@ -13,30 +12,11 @@ class ValuesRender(SearchBase):
         'updated_date', 'created_date'
     ]
 
-    @staticmethod
-    def obj_id(**value_obj):
-        """Return string for object id."""
-        return text_type('values_{_id}').format(**value_obj)
-
-    @staticmethod
-    def updated_date(**value_obj):
-        """Return string for the updated date."""
-        return text_type('{updated}').format(**value_obj)
-
-    @staticmethod
-    def created_date(**value_obj):
-        """Return string for the created date."""
-        return text_type('{created}').format(**value_obj)
-
-    @staticmethod
-    def display_name(**value_obj):
-        """Return the string to render display_name."""
-        return text_type('{display_name}').format(**value_obj)
-
-    @staticmethod
-    def keyword(**value_obj):
-        """Return the rendered string for keywords."""
-        return text_type('{value}').format(**value_obj)
+    obj_id = format_field('values_{_id}', 'Return string for object id.')
+    updated_date = format_field('{updated}', 'Return string for the updated date.')
+    created_date = format_field('{created}', 'Return string for the created date.')
+    display_name = format_field('{display_name}', 'Return the string to render display_name.')
+    keyword = format_field('{value}', 'Return the rendered string for keywords.')
 
     @classmethod
     def release(cls, **_value_obj):
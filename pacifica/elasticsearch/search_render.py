@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 """This is the render object for the search interface."""
 import importlib
-from six import text_type
+from itertools import islice
 from .config import get_config
+from .instrumentation import count
+from .render.base import render_memo
 
 ELASTIC_INDEX = get_config().get('elasticsearch', 'index')
+STREAM_CHUNK_SIZE = get_config().getint('elasticsearch', 'stream_chunk_size')
 
 
 class SearchRender:
@@ -32,27 +35,62 @@ class SearchRender:
         return False
 
     @classmethod
-    def generate(cls, obj_cls, objs, exclude):
+    def chunk_objects(cls, obj_cls, objs, exclude):
+        """Yield lists of objects not excluded of at most the stream chunk size."""
+        objs = (obj for obj in objs if not cls.object_exclude(obj_cls, obj, exclude))
+        chunk = list(islice(objs, STREAM_CHUNK_SIZE))
+        while chunk:
+            yield chunk
+            chunk = list(islice(objs, STREAM_CHUNK_SIZE))
+
+    @classmethod
+    def document_render_class(cls, obj_cls, files_as_docs=False):
+        """Get the render class for the documents of the object."""
+        if files_as_docs and obj_cls == 'transactions':
+            return cls.get_render_class('transactions_summary')
+        return cls.get_render_class(obj_cls)
+
+    @classmethod
+    def generate(cls, obj_cls, objs, exclude, files_as_docs=False, rebuild_index=None):
         """generate the institution object."""
-        render_cls = cls.get_render_class(obj_cls)
-        for obj in objs:
-            if cls.object_exclude(obj_cls, obj, exclude):
-                continue
+        render_cls = cls.document_render_class(obj_cls, files_as_docs)
+        with render_memo():
+            for chunk in cls.chunk_objects(obj_cls, objs, exclude):
+                yield from cls.generate_chunk(obj_cls, render_cls, chunk, rebuild_index)
+
+    @classmethod
+    def generate_chunk(cls, obj_cls, render_cls, chunk, rebuild_index=None):
+        """Return the bulk actions for a chunk of objects."""
+        with render_cls.prefetch(chunk):
+            actions = [
+                action for obj in chunk
+                for action in cls.generate_obj(obj_cls, render_cls, obj, rebuild_index)
+            ]
+        count('docs', len(actions))
+        return actions
+
+    @classmethod
+    def generate_obj(cls, obj_cls, render_cls, obj, rebuild_index=None):
+        """
+        Generate the bulk actions for one object.
+
+        Documents are upserted into the live index or, when rebuilding,
+        indexed whole into the new index.
+        """
+        if rebuild_index:
             yield {
-                '_op_type': 'update',
-                '_index': ELASTIC_INDEX,
+                '_op_type': 'index',
+                '_index': rebuild_index,
                 '_type': 'doc',
                 '_id': render_cls.obj_id(**obj),
-                'doc': render_cls.render(obj, True, obj_cls != 'transactions'),
-                'doc_as_upsert': True
+                '_source': render_cls.render(obj, True, obj_cls != 'transactions')
             }
-            if obj_cls == 'projects':
-                st_render_cls = cls.get_render_class('science_themes')
-                yield {
-                    '_op_type': 'update',
-                    '_index': ELASTIC_INDEX,
-                    '_type': 'doc',
-                    '_id': text_type('science_themes_{}').format(obj['science_theme']),
-                    'doc': st_render_cls.render(obj, True, True),
-                    'doc_as_upsert': True
-                }
+            return
+        yield {
+            '_op_type': 'update',
+            '_index': ELASTIC_INDEX,
+            '_type': 'doc',
+            '_id': render_cls.obj_id(**obj),
+            'doc': render_cls.render(obj, True, obj_cls != 'transactions'),
+            'doc_as_upsert': True
+        }
@@ -3,46 +3,112 @@
 """Sync the database to elasticsearch index for use by Searching tools."""
 from __future__ import print_function, absolute_import
 import os
+from hashlib import sha1
 from json import dumps, loads
 from time import sleep
-from threading import Thread
+from threading import Lock, Thread
 from queue import Queue
 from math import ceil
 from datetime import datetime
 from itertools import zip_longest
 from elasticsearch import Elasticsearch, ElasticsearchException, helpers
-from pacifica.metadata.rest.objectinfo import ObjectInfoAPI
 from .config import get_config
 from .celery import CeleryQueue
+from .process import ProcessQueue
+from .async_queue import AsyncQueue
+from .checkpoint import SyncCheckpoint
+from .globals import CHECKPOINT_FILE
+from .connections import configure_db_pool, metadata_db, thread_connection
+from .instrumentation import CountingSerializer, JobMetrics, activate, emit, timed, write_run_metrics
 from .search_render import ELASTIC_INDEX, SearchRender
+from .render.base import close_render_memo, keyset_boundaries, open_render_memo
+from .render.cache import TABLE_GENERATIONS
+from .unchanged import UnchangedFilter
+from .pipeline import SyncPipeline
+from .rebuild import IndexRebuild
+from .profiler import QUERY_PROFILER
 
 ELASTIC_CONNECT_ATTEMPTS = 40
 ELASTIC_WAIT = 3
+MAPPING_FILE = os.path.join(os.path.dirname(__file__), 'mapping.json')
+_BOOTSTRAP = {'lock': Lock(), 'done': False}
 
 
-def es_client():
-    """Get the elasticsearch client object."""
+def es_client_kwargs(maxsize=0):
+    """
+    Return the keyword arguments for the elasticsearch client.
+
+    The connection pool keeps at least maxsize connections alive so
+    the threads sharing the client don't open new ones for each bulk
+    request.
+    """
     es_kwargs = {}
     if get_config().getboolean('elasticsearch', 'sniff'):
         es_kwargs['sniff_on_start'] = True
         es_kwargs['sniff_on_connection_fail'] = True
         es_kwargs['sniff_timeout'] = get_config().getint('elasticsearch', 'timeout')
     es_kwargs['timeout'] = get_config().getint('elasticsearch', 'timeout')
-    esclient = Elasticsearch(
+    es_kwargs['maxsize'] = max(maxsize, get_config().getint('elasticsearch', 'maxsize'))
+    es_kwargs['http_compress'] = get_config().getboolean('elasticsearch', 'http_compress')
+    es_kwargs['serializer'] = CountingSerializer()
+    return es_kwargs
+
+
+def es_connection(maxsize=0):
+    """Get the elasticsearch client object without setting up the index."""
+    return Elasticsearch(
         [get_config().get('elasticsearch', 'url')],
-        **es_kwargs
+        **es_client_kwargs(maxsize)
     )
-    mapping_params = loads(open(os.path.join(os.path.dirname(__file__), 'mapping.json')).read())
+
+
+def es_client(maxsize=0):
+    """Get the elasticsearch client object with the index bootstrapped."""
+    esclient = es_connection(maxsize)
+    bootstrap_index(esclient)
+    return esclient
+
+
+def mapping_params():
+    """Return the mapping with the hash of its content in the mapping metadata."""
+    with open(MAPPING_FILE) as mapping_fd:
+        params = loads(mapping_fd.read())
+    params['_meta'] = {'mapping_hash': sha1(dumps(params, sort_keys=True).encode('utf-8')).hexdigest()}
+    return params
+
+
+def indexed_mapping_hash(esclient):
+    """Return the mapping hash stored in the index metadata or None."""
+    resp = esclient.indices.get_mapping(index=ELASTIC_INDEX, ignore=404)
+    if 'error' in resp:
+        return None
+    for index_mapping in resp.values():
+        return index_mapping.get('mappings', {}).get('_meta', {}).get('mapping_hash')
+    return None
+
+
+def bootstrap_index(esclient):
+    """Install the mapping once per process unless the index already has the same mapping hash."""
+    with _BOOTSTRAP['lock']:
+        if _BOOTSTRAP['done']:
+            return
+        params = mapping_params()
+        if indexed_mapping_hash(esclient) != params['_meta']['mapping_hash']:
+            install_mapping(esclient, params)
+        _BOOTSTRAP['done'] = True
+
+
+def install_mapping(esclient, params):
+    """Create the index and put the mapping."""
     # pylint: disable=unexpected-keyword-arg
     esclient.indices.create(index=ELASTIC_INDEX, ignore=400)
     esclient.indices.put_mapping(
         index=ELASTIC_INDEX,
         doc_type='doc',
         include_type_name=True,
-        body=dumps(mapping_params)
+        body=dumps(params)
     )
     # pylint: enable=unexpected-keyword-arg
-    return esclient
 
 
 def try_es_connect(attempts=0):
@@ -59,78 +125,175 @@ def try_es_connect(attempts=0):
             raise ex
 
 
-def start_work(work_queue):
-    """The main thread for the work."""
-    cli = es_client()
+def start_work(work_queue, checkpoint, cli):
+    """The main thread for the work sharing the elasticsearch client."""
     job = work_queue.get()
     while job:
         num_pages = job.pop('num_pages')
         print('Starting {object} ({time_field}): {page} of {num_pages}'.format(num_pages=num_pages, **job))
-        try_doing_work(cli, job)
+        checkpoint.page_done(job, try_doing_work(cli, job))
         work_queue.task_done()
         print('Finished {object} ({time_field}): {page} of {num_pages}'.format(num_pages=num_pages, **job))
         job = work_queue.get()
     work_queue.task_done()
 
 
+def bulk_upload(cli, actions):
+    """
+    Upload the actions and return the list of failed items.
+
+    Documents rejected with a 429 are retried with exponential backoff
+    by the bulk helper, other failures are reported and not retried.
+    """
+    failures = []
+    for _success, item in helpers.streaming_bulk(cli, actions, **bulk_kwargs()):
+        print_failure(item)
+        failures.append(item)
+    return failures
+
+
+def bulk_kwargs():
+    """Return the keyword arguments for the streaming bulk helpers."""
+    return {
+        'chunk_size': get_config().getint('elasticsearch', 'bulk_chunk_size'),
+        'max_chunk_bytes': get_config().getint('elasticsearch', 'bulk_max_chunk_bytes'),
+        'max_retries': get_config().getint('elasticsearch', 'bulk_max_retries'),
+        'initial_backoff': get_config().getint('elasticsearch', 'bulk_initial_backoff'),
+        'max_backoff': get_config().getint('elasticsearch', 'bulk_max_backoff'),
+        'raise_on_error': False,
+        'yield_ok': False
+    }
+
+
+def print_failure(item):
+    """Print the failed bulk item."""
+    op_type, result = next(iter(item.items()))
+    print('Failed {op_type} {_id} ({status}): {error}'.format(
+        op_type=op_type, _id=result.get('_id'), status=result.get('status'), error=result.get('error')
+    ))
+
+
 def try_doing_work(cli, job):
     """Try doing some work even if you fail."""
-    tries_left = 5
+    metrics = JobMetrics(job)
     success = False
-    while not success and tries_left:
-        try:
-            helpers.bulk(cli, yield_data(**job))
-            success = True
-        except ElasticsearchException:  # pragma: no cover
-            tries_left -= 1
+    tries_left = 5
+    with activate(metrics), thread_connection(metadata_db()):
+        TABLE_GENERATIONS.invalidate_changed(job['time_delta'])
+        while tries_left:
+            try:
+                success = upload_job(cli, job)
+                break
+            except ElasticsearchException:  # pragma: no cover
+                tries_left -= 1
+    metrics.finish(success)
+    emit(metrics)
     return success
 
 
+def upload_job(cli, job):
+    """Upload the documents for the job skipping unchanged ones if asked and return success."""
+    if job.get('pipeline'):
+        pipeline = SyncPipeline(cli)
+        failures = pipeline.run(job)
+        if job.get('skip_unchanged'):
+            print_skipped(sum(unchanged.skipped for unchanged in pipeline.unchanged), job)
+        return not failures
+    if not job.get('skip_unchanged'):
+        return not bulk_upload(cli, yield_data(**job))
+    unchanged = UnchangedFilter(cli)
+    failures = bulk_upload(cli, unchanged.filter(yield_data(**job)))
+    unchanged.save(failures)
+    print_skipped(unchanged.skipped, job)
+    return not failures
+
+
+def print_skipped(skipped, job):
+    """Print the number of unchanged documents skipped for the job."""
+    print('Skipped {skipped} unchanged documents for {object} ({time_field}): {page}'.format(
+        skipped=skipped, **job
+    ))
+
+
 def yield_data(**kwargs):
     """yield objects from obj for bulk ingest."""
     obj = kwargs.pop('object')
     exclude = kwargs.pop('exclude')
-    obj_cls = ObjectInfoAPI.get_class_object_from_name(obj)
+    files_as_docs = kwargs.pop('files_as_docs', False)
+    kwargs.pop('skip_unchanged', None)
+    kwargs.pop('pipeline', None)
+    rebuild_index = kwargs.pop('rebuild_index', None)
     render_cls = SearchRender.get_render_class(obj)
-    query = render_cls.get_select_query(obj_cls=obj_cls, **kwargs)
-    return SearchRender.generate(obj, [qobj.to_hash() for qobj in query], exclude)
+    query = render_cls.get_select_query(obj_cls=render_cls.object_class(), **kwargs)
+    objs = timed('select', render_cls.stream_objects(query))
+    return timed('render', SearchRender.generate(obj, objs, exclude, files_as_docs, rebuild_index))
 
 
-def create_worker_threads(threads, work_queue):
-    """Create the worker threads and return the list."""
+def create_worker_threads(threads, work_queue, checkpoint, cli):
+    """Create the worker threads sharing the elasticsearch client and return the list."""
     work_threads = []
     for _i in range(threads):
-        wthread = Thread(target=start_work, args=(work_queue,))
+        wthread = Thread(target=start_work, args=(work_queue, checkpoint, cli))
         wthread.daemon = True
         wthread.start()
         work_threads.append(wthread)
     return work_threads
 
 
-def generate_work(args, work_queue):
+def generate_pages(args, render_cls, query):
+    """Generate the paging arguments for each page of the query."""
+    if args.keyset_paging and render_cls.keyset_pageable:
+        id_highs = list(keyset_boundaries(query, args.items_per_page))
+        id_lows = [None] + id_highs[:-1]
+        return [{'id_low': id_low, 'id_high': id_high} for id_low, id_high in zip(id_lows, id_highs)]
+    num_pages = int(ceil(float(query.count()) / args.items_per_page))
+    return [{} for _page in range(num_pages)]
+
+
+def generate_jobs(args, obj, time_field, time_delta):
+    """Generate the job dictionaries for an object and time field."""
+    render_cls = SearchRender.get_render_class(obj)
+    query = render_cls.get_select_query(
+        obj_cls=render_cls.object_class(), time_delta=time_delta,
+        enable_paging=False, time_field=time_field,
+        change_query=args.change_query
+    )
+    pages = generate_pages(args, render_cls, query)
+    jobs = []
+    for page, page_args in enumerate(pages, 1):
+        job = {
+            'object': obj,
+            'time_field': time_field,
+            'page': page,
+            'items_per_page': args.items_per_page,
+            'time_delta': time_delta,
+            'change_query': args.change_query,
+            'files_as_docs': args.files_as_docs,
+            'skip_unchanged': args.skip_unchanged,
+            'pipeline': args.pipeline,
+            'rebuild_index': args.rebuild_index,
+            'num_pages': len(pages),
+            'exclude': list(args.exclude)
+        }
+        job.update(page_args)
+        jobs.append(job)
+    return jobs
+
+
+def generate_work(args, work_queue, checkpoint):
     """Generate the work from the db and send it to the work queue."""
-    time_delta = (datetime.now() - args.time_ago).replace(microsecond=0)
+    sync_time = datetime.now().replace(microsecond=0)
+    default_time_delta = (sync_time - args.time_ago).replace(microsecond=0)
     work = []
     for obj in args.objects:
         obj_q = []
         for time_field in args.compare_dates:
-            obj_cls = ObjectInfoAPI.get_class_object_from_name(obj)
-            render_cls = SearchRender.get_render_class(obj)
-            query = render_cls.get_select_query(
-                obj_cls=obj_cls, time_delta=time_delta,
-                enable_paging=False, time_field=time_field
-            )
-            num_pages = int(ceil(float(query.count()) / args.items_per_page))
-            for page in range(1, num_pages + 1):
-                obj_q.append({
-                    'object': obj,
-                    'time_field': time_field,
-                    'page': page,
-                    'items_per_page': args.items_per_page,
-                    'time_delta': time_delta,
-                    'num_pages': num_pages,
-                    'exclude': list(args.exclude)
-                })
+            time_delta = default_time_delta
+            if args.since_last_sync and checkpoint.get(obj, time_field):
+                time_delta = checkpoint.get(obj, time_field)
+            jobs = generate_jobs(args, obj, time_field, time_delta)
+            checkpoint.expect(obj, time_field, len(jobs), time_delta, sync_time)
+            obj_q.extend(jobs)
         work.append(obj_q)
     for work_slice in zip_longest(*work, fillvalue=None):
         for item in work_slice:
@@ -138,19 +301,101 @@ def generate_work(args, work_queue):
                 work_queue.put(item)
 
 
+def sync_objects(args):
+    """Return the objects to sync including the ones derived from other objects."""
+    objects = list(args.objects)
+    if 'projects' in objects and 'science_themes' not in objects:
+        objects.append('science_themes')
+    if args.files_as_docs and 'transactions' in objects and 'files' not in objects:
+        objects.append('files')
+    return objects
+
+
+def job_connections(pipeline):
+    """
+    Return the number of database and elasticsearch connections a job uses at once.
+
+    A pipeline job holds the connection of the thread working on the
+    job and one for each fetch and render stage thread.
+    """
+    if not pipeline:
+        return 1, 1
+    return (
+        1 + get_config().getint('elasticsearch', 'pipeline_fetch_workers') +
+        get_config().getint('elasticsearch', 'pipeline_render_workers'),
+        get_config().getint('elasticsearch', 'pipeline_upload_workers')
+    )
+
+
+def db_pool_size(args):
+    """Return the database connections needed by the workers of this process and the main thread."""
+    if args.celery or args.processes:
+        return 1
+    if args.use_async:
+        return args.concurrency + 1
+    return args.threads * job_connections(args.pipeline)[0] + 1
+
+
+def finish_rebuild(rebuild, checkpoint):
+    """Swap the alias to the rebuilt index unless some pages failed."""
+    if checkpoint.failed_pages:
+        print('Not swapping {} to {}: {} pages failed'.format(rebuild.alias, rebuild.index, checkpoint.failed_pages))
+        return False
+    rebuild.finish()
+    return True
+
+
+def checkpoint_filename(args):
+    """Return the checkpoint file to keep or None unless syncing since the last sync."""
+    if args.checkpoint_file:
+        return args.checkpoint_file
+    return CHECKPOINT_FILE if args.since_last_sync else None
+
+
+def create_work_queue(args, checkpoint):
+    """Return the work queue for the driver and the worker threads if the driver uses them."""
+    if args.celery:
+        return CeleryQueue(), []
+    if args.use_async:
+        return AsyncQueue(args.concurrency), []
+    if args.processes:
+        return ProcessQueue(args.processes, args.profile_queries, job_connections(args.pipeline)), []
+    work_queue = Queue(32)
+    return work_queue, create_worker_threads(
+        args.threads, work_queue, checkpoint, es_client(args.threads * job_connections(args.pipeline)[1])
+    )
+
+
 def search_sync(args):
     """Main search sync subcommand."""
     try_es_connect()
-    if args.celery:
-        work_queue = CeleryQueue()
-    else:
-        work_queue = Queue(32)
-        work_threads = create_worker_threads(args.threads, work_queue)
-    generate_work(args, work_queue)
-    if args.celery:
-        return work_queue.progress(args)
-    for _i in range(args.threads):
-        work_queue.put(False)
-    for wthread in work_threads:
-        wthread.join()
-    return work_queue.join()
+    configure_db_pool(metadata_db(), db_pool_size(args))
+    if args.profile_queries:
+        QUERY_PROFILER.install(metadata_db())
+    checkpoint = SyncCheckpoint(checkpoint_filename(args))
+    args.objects = sync_objects(args)
+    rebuild = IndexRebuild(es_connection()) if args.rebuild else None
+    args.rebuild_index = rebuild.create(mapping_params()) if rebuild else None
+    # the sub-documents are rendered once for the run
+    render_memo_opened = open_render_memo()
+    try:
+        work_queue, work_threads = create_work_queue(args, checkpoint)
+        generate_work(args, work_queue, checkpoint)
+        if args.celery or args.use_async or args.processes:
+            success = work_queue.progress(args, checkpoint)
+        else:
+            for _i in range(args.threads):
+                work_queue.put(False)
+            for wthread in work_threads:
+                wthread.join()
+            work_queue.join()
+            success = not checkpoint.failed_pages
+        if rebuild is not None and not finish_rebuild(rebuild, checkpoint):
+            return False
+        return success
+    finally:
+        if render_memo_opened:
+            close_render_memo()
+        write_run_metrics()
+        if args.profile_queries:
+            QUERY_PROFILER.print_top(args.profile_queries)
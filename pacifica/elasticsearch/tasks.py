@@ -2,11 +2,13 @@
 # -*- coding: utf-8 -*-
 """Celery tasks for processing work to elasticsearch."""
 from __future__ import absolute_import
+from functools import lru_cache
 from celery import Celery
 from .config import get_config
-from .search_sync import es_client, try_doing_work
+from .connections import configure_db_pool, metadata_db
+from .instrumentation import RUN_METRICS
+from .search_sync import es_client, job_connections, try_doing_work
 
-ES_CLI = es_client()
 ES_APP = Celery(
     'elasticsearch',
     broker=get_config().get('celery', 'broker_url'),
@@ -14,8 +16,25 @@ ES_APP = Celery(
 )
 
 
+@lru_cache(maxsize=1)
+def worker_client():  # pragma: no cover
+    """Size the connection pools for a pipeline job and create the elasticsearch client on first use."""
+    db_connections, es_connections = job_connections(True)
+    configure_db_pool(metadata_db(), db_connections)
+    return es_client(es_connections)
+
+
 # Coverage doesn't seem to be catching this.
 @ES_APP.task()
 def work_on_job(job):  # pragma: no cover
     """Work on a job."""
-    return try_doing_work(ES_CLI, job)
+    return try_doing_work(worker_client(), job)
+
+
+@ES_APP.task()
+def work_on_jobs(jobs):  # pragma: no cover
+    """Work on a batch of jobs and return their success, the documents rendered and the job metrics."""
+    RUN_METRICS.drain()
+    success = [try_doing_work(worker_client(), job) for job in jobs]
+    job_metrics = RUN_METRICS.drain()
+    return {'success': success, 'docs': sum(job_hash['docs'] for job_hash in job_metrics), 'metrics': job_metrics}
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Skip bulk actions for documents that have not changed."""
+from hashlib import sha1
+from itertools import islice
+from json import dumps
+from threading import Lock
+from .config import get_config
+from .instrumentation import count
+from .search_render import ELASTIC_INDEX, STREAM_CHUNK_SIZE
+from .render.cache import SQLiteCache
+
+
+def content_hash(doc):
+    """Return the fingerprint of the rendered document content."""
+    return sha1(dumps(doc, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def hash_index():
+    """Return the local side index of content hashes or None to ask elasticsearch."""
+    filename = get_config().get('elasticsearch', 'content_hash_index')
+    if not filename:
+        return None
+    return SQLiteCache(filename, 0)
+
+
+class SkipStats:
+    """Thread safe counters of sent and skipped documents."""
+
+    def __init__(self):
+        """Start the counters at zero."""
+        self._lock = Lock()
+        self.sent = 0
+        self.skipped = 0
+
+    def add(self, sent, skipped):
+        """Add to the counters."""
+        with self._lock:
+            self.sent += sent
+            self.skipped += skipped
+
+    def to_hash(self):
+        """Return the counters as a dictionary."""
+        return {'sent': self.sent, 'skipped': self.skipped}
+
+
+SKIP_STATS = SkipStats()
+
+
+class UnchangedFilter:
+    """
+    Filter bulk actions whose content hash is already indexed.
+
+    The content hash is stored on each document sent. The hashes to
+    compare against come from the local side index if one is configured
+    or are fetched from elasticsearch for each chunk of actions.
+    """
+
+    def __init__(self, cli):
+        """Save the client and open the side index."""
+        self.cli = cli
+        self.index = hash_index()
+        self.sent = {}
+        self.skipped = 0
+
+    def existing_hashes(self, doc_ids):
+        """Return the indexed content hash for each of the document ids."""
+        if self.index is not None:
+            return self.index.get_many(doc_ids)
+        resp = self.cli.mget(body={'ids': doc_ids}, index=ELASTIC_INDEX, _source_includes=['content_hash'])
+        return {
+            doc['_id']: doc['_source'].get('content_hash')
+            for doc in resp['docs'] if doc.get('found')
+        }
+
+    def filter(self, actions):
+        """Yield the actions for changed documents with the content hash added."""
+        chunk = list(islice(actions, STREAM_CHUNK_SIZE))
+        while chunk:
+            hashes = [content_hash(action['doc']) for action in chunk]
+            existing = self.existing_hashes(list(set(action['_id'] for action in chunk)))
+            changed = []
+            for action, doc_hash in zip(chunk, hashes):
+                if doc_hash in (existing.get(action['_id']), self.sent.get(action['_id'])):
+                    continue
+                action['doc']['content_hash'] = doc_hash
+                self.sent[action['_id']] = doc_hash
+                changed.append(action)
+            self.skipped += len(chunk) - len(changed)
+            count('skipped', len(chunk) - len(changed))
+            yield from changed
+            chunk = list(islice(actions, STREAM_CHUNK_SIZE))
+
+    def save(self, failures):
+        """Save the hashes of the documents sent without failure to the side index."""
+        SKIP_STATS.add(len(self.sent), self.skipped)
+        if self.index is None:
+            return
+        for item in failures:
+            _op_type, result = next(iter(item.items()))
+            self.sent.pop(result.get('_id'), None)
+        self.index.set_many(self.sent)
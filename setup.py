@@ -27,6 +27,10 @@ setup(
         'python-dateutil',
         'tqdm'
     ],
+    extras_require={
+        'async': ['elasticsearch[async]'],
+        'redis': ['redis']
+    },
     include_package_data=True,
     package_data={'': ['*.json']},
     entry_points={
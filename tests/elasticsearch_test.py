@@ -4,15 +4,125 @@
 import os
 import sys
 import subprocess
+from contextlib import contextmanager, redirect_stdout
+from io import StringIO
+from tempfile import mkdtemp
+from types import SimpleNamespace
 from unittest import TestCase
 from time import sleep
 import json
+import re
 import jsonschema
 import requests
 from celery.bin.celery import main as celery_main
 
+METRICS_DIR = mkdtemp()
 
-class TestElasticsearch(TestCase):
+
+@contextmanager
+def elasticsearch_config(**values):
+    """Set the elasticsearch config values for the duration of the context."""
+    # pylint: disable=import-outside-toplevel
+    from pacifica.elasticsearch.config import get_config
+    previous = {key: get_config().get('elasticsearch', key) for key in values}
+    for key, value in values.items():
+        get_config().set('elasticsearch', key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            get_config().set('elasticsearch', key, value)
+
+
+@contextmanager
+def counted_queries():
+    """Count the queries run against the metadata database in the context."""
+    # pylint: disable=import-outside-toplevel
+    from pacifica.metadata.orm.globals import DB
+    from pacifica.elasticsearch.profiler import QUERY_PROFILER
+    QUERY_PROFILER.install(DB)
+    QUERY_PROFILER.drain()
+    counts = {}
+    try:
+        yield counts
+    finally:
+        counts['callers'] = {caller: stats[0] for caller, stats in QUERY_PROFILER.drain().items()}
+        counts['queries'] = sum(counts['callers'].values())
+
+
+class StubBulkClient:  # pylint: disable=too-few-public-methods
+    """Elasticsearch client stub rejecting the first document with a 429 and the second with an error."""
+
+    def __init__(self):
+        """Start with no bulk requests."""
+        # pylint: disable=import-outside-toplevel
+        from elasticsearch import Transport
+        self.transport = Transport([{}])
+        self.requests = []
+
+    def bulk(self, body, *_args, **_kwargs):
+        """Reject the documents on the first request and accept the retried ones."""
+        docs = [json.loads(line) for line in body.splitlines()[0::2]]
+        self.requests.append([doc['update']['_id'] for doc in docs])
+        items = []
+        for doc in docs:
+            status = 200
+            if doc['update']['_id'] == 'users_1' and len(self.requests) == 1:
+                status = 429
+            elif doc['update']['_id'] == 'users_2':
+                status = 400
+            items.append({'update': {
+                '_id': doc['update']['_id'], 'status': status, 'error': {} if status > 200 else None
+            }})
+        return {'errors': True, 'items': items}
+
+
+class FakeAsyncResult:
+    """Celery result stub of a task that is not ready until finished."""
+
+    def __init__(self, result):
+        """Save the result the task returns."""
+        self.result = result
+        self.done = False
+
+    def ready(self):
+        """Return whether the test finished the task."""
+        return self.done
+
+    @staticmethod
+    def successful():
+        """Return the task itself succeeded."""
+        return True
+
+
+class FakeTask:
+    """Celery task stub keeping the results of the batches sent."""
+
+    def __init__(self, fail_pages):
+        """Save the number of times each page fails before it succeeds."""
+        self.fail_pages = fail_pages
+        self.results = []
+
+    def delay(self, batch):
+        """Send the batch and return its result."""
+        success = []
+        for job in batch:
+            success.append(not self.fail_pages.get(job['page']))
+            if not success[-1]:
+                self.fail_pages[job['page']] -= 1
+        self.results.append(FakeAsyncResult({
+            'success': success, 'docs': len(batch),
+            'metrics': [{'object': job['object'], 'page': job['page'], 'success': True, 'docs': 1} for job in batch]
+        }))
+        return self.results[-1]
+
+    def finish_all(self):
+        """Finish every task sent."""
+        for result in self.results:
+            result.done = True
+
+
+class TestElasticsearch(TestCase):  # pylint: disable=too-many-public-methods
     """Test the example class."""
 
     env_hash = {
@@ -20,7 +130,10 @@ class TestElasticsearch(TestCase):
         'BACKEND_URL': 'redis://127.0.0.1:6379/0',
         'NOTIFICATIONS_DISABLED': 'True',
         'ADMIN_USER_ID': '10',
-        'CACHE_SIZE': '0'
+        'CACHE_SIZE': '0',
+        'METRICS_FILE': os.path.join(METRICS_DIR, 'metrics.jsonl'),
+        'PROMETHEUS_TEXTFILE': os.path.join(METRICS_DIR, 'search_sync.prom'),
+        'ELASTICSEARCH_CHECKPOINT': os.path.join(METRICS_DIR, 'checkpoint.json')
     }
 
     @classmethod
@@ -74,8 +187,8 @@ class TestElasticsearch(TestCase):
         # The environment needs to be set before import
         # pylint: disable=import-outside-toplevel
         from pacifica.elasticsearch.__main__ import main
-        main('--objects-per-page', '4', '--threads', '1',
-             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        self.assertIs(main('--objects-per-page', '4', '--threads', '1',
+                           '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after'), True)
         sleep(3)
         resp = requests.post('http://localhost:9200/pacifica_search/_flush/synced')
         self.assertEqual(resp.status_code, 200)
@@ -84,6 +197,457 @@ class TestElasticsearch(TestCase):
         self.assertEqual(resp.json()['indices']['pacifica_search']['primaries']['docs']['count'], 44)
         resp = requests.get('http://localhost:9200/pacifica_search/doc/transactions_67')
         self.assertEqual(resp.status_code, 200)
+        self.assertFalse(os.path.exists(self.env_hash['ELASTICSEARCH_CHECKPOINT']))
+
+    def run_metrics(self):
+        """Return the samples of the Prometheus textfile of the last run by metric and object."""
+        samples = {}
+        with open(self.env_hash['PROMETHEUS_TEXTFILE']) as prom_fd:
+            for line in prom_fd:
+                if line.startswith('#'):
+                    continue
+                sample, value = line.split()
+                metric, obj = re.match(r'pacifica_search_sync_(\w+)\{object="(\w+)"\}', sample).groups()
+                samples.setdefault(metric, {})[obj] = float(value)
+        return samples
+
+    def assert_same_sync(self, expected):
+        """Assert the last run synced the expected documents of each object without failures."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.metadata.orm import Transactions
+        from pacifica.elasticsearch.search_render import SearchRender
+        samples = self.run_metrics()
+        self.assertEqual(samples['docs'], expected['docs'])
+        self.assertFalse(any(samples['failed_jobs'].values()))
+        sleep(3)
+        resp = requests.get('http://localhost:9200/pacifica_search/doc/transactions_67')
+        self.assertEqual(resp.status_code, 200)
+        action = next(SearchRender.generate('transactions', [Transactions.get_by_id(67).to_hash()], []))
+        for key, value in action['doc'].items():
+            self.assertEqual(resp.json()['_source'][key], value)
+
+    def test_main_keyset_paging(self):
+        """Test the main method with keyset paging."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        self.test_main()
+        expected = self.run_metrics()
+        main('--objects-per-page', '4', '--threads', '1', '--keyset-paging',
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        self.assert_same_sync(expected)
+
+    def test_main_processes(self):
+        """Test the main method with a process pool."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        self.test_main()
+        expected = self.run_metrics()
+        self.assertIs(main('--objects-per-page', '4', '--processes', '2',
+                           '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after'), True)
+        self.assert_same_sync(expected)
+
+    def test_main_async(self):
+        """Test the main method with the asyncio engine."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        self.test_main()
+        expected = self.run_metrics()
+        main('--objects-per-page', '4', '--async', '--concurrency', '2',
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        self.assert_same_sync(expected)
+
+    def test_main_pipeline(self):
+        """Test the main method with the staged pipeline."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        self.test_main()
+        expected = self.run_metrics()
+        main('--objects-per-page', '4', '--threads', '1', '--pipeline', '--keyset-paging',
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        self.assert_same_sync(expected)
+
+    def test_main_files_as_documents(self):
+        """Test the main method with files as their own documents."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        main('--objects-per-page', '4', '--threads', '1', '--files-as-documents',
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        sleep(3)
+        resp = requests.get('http://localhost:9200/pacifica_search/doc/transactions_67')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['_source']['files'], [])
+        self.assertTrue(resp.json()['_source']['files_summary']['count'])
+        resp = requests.post('http://localhost:9200/pacifica_search/_search', json={
+            'query': {'bool': {'filter': [
+                {'term': {'type': 'files'}},
+                {'match': {'transaction_ids': 'transactions_67'}}
+            ]}}
+        })
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json()['hits']['total']['value'],
+            requests.get('http://localhost:9200/pacifica_search/doc/transactions_67').json()[
+                '_source']['files_summary']['count']
+        )
+
+    def test_main_skip_unchanged(self):
+        """Test unchanged documents are skipped and changed ones are sent again."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.metadata.orm import Users
+        from pacifica.elasticsearch.__main__ import main
+        from pacifica.elasticsearch.unchanged import SKIP_STATS
+        sync_args = ['--objects-per-page', '4', '--threads', '1', '--skip-unchanged',
+                     '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after']
+        main(*sync_args)
+        sent = SKIP_STATS.sent
+        main(*sync_args)
+        samples = self.run_metrics()
+        self.assertTrue(sum(samples['docs'].values()))
+        self.assertEqual(samples['skipped'], samples['docs'])
+        self.assertEqual(SKIP_STATS.sent, sent)
+        user = Users.select().order_by(Users.id).first()
+        Users.update(first_name='Changed', updated=datetime.now()).where(Users.id == user.id).execute()
+        try:
+            main(*sync_args)
+        finally:
+            Users.update(first_name=user.first_name, updated=datetime.now()).where(Users.id == user.id).execute()
+        self.assertGreater(SKIP_STATS.sent, sent)
+        sleep(3)
+        resp = requests.get('http://localhost:9200/pacifica_search/doc/users_{}'.format(user.id))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Changed', resp.json()['_source']['display_name'])
+        self.assertTrue(resp.json()['_source']['content_hash'])
+
+    def test_main_metrics(self):
+        """Test the job metrics are written as JSON lines and a Prometheus textfile."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        main('--objects-per-page', '4', '--threads', '1', '--object', 'transactions',
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        with open(self.env_hash['METRICS_FILE']) as metrics_fd:
+            jobs = [json.loads(line) for line in metrics_fd]
+        transactions = [job for job in jobs if job['object'] == 'transactions']
+        self.assertTrue(transactions)
+        self.assertTrue(all(job['success'] for job in transactions))
+        self.assertTrue(sum(job['docs'] for job in transactions))
+        self.assertTrue(sum(job['bytes_sent'] for job in transactions))
+        with open(self.env_hash['PROMETHEUS_TEXTFILE']) as prom_fd:
+            self.assertIn('pacifica_search_sync_docs{object="transactions"}', prom_fd.read())
+
+    def test_emit_without_metrics_file(self):
+        """Test the job metrics are only logged at debug level without a metrics file."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.instrumentation import RUN_METRICS, JobMetrics, emit
+        metrics = JobMetrics({'object': 'users', 'time_field': 'updated', 'page': 1})
+        metrics.finish(True)
+        output = StringIO()
+        with elasticsearch_config(metrics_file=''), redirect_stdout(output), \
+                self.assertLogs('pacifica.elasticsearch.instrumentation', 'DEBUG') as logs:
+            emit(metrics)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['object'], 'users')
+        self.assertEqual(RUN_METRICS.drain()[-1]['object'], 'users')
+
+    def test_main_profile_queries(self):
+        """Test the queries are attributed to the render methods."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        output = StringIO()
+        with redirect_stdout(output):
+            main('--objects-per-page', '4', '--threads', '1', '--object', 'transactions',
+                 '--profile-queries', '50', '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        self.assertIn('TransactionsRender.prefetch', output.getvalue())
+
+    def test_change_query(self):
+        """Test the union and join change queries select the same objects."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime, timedelta
+        from pacifica.metadata.orm import TransSIP, Users
+        from pacifica.elasticsearch.search_render import SearchRender
+        trans_sip = TransSIP.select().order_by(TransSIP.id).first()
+        updated = datetime.now().replace(microsecond=0)
+        Users.update(updated=updated).where(Users.id == trans_sip.submitter_id).execute()
+        selected = {}
+        for obj in ['transactions', 'projects', 'users']:
+            render_cls = SearchRender.get_render_class(obj)
+            for change_query in ['union', 'join']:
+                selected[(obj, change_query)] = set(
+                    md_obj.get_id() for md_obj in render_cls.get_select_query(
+                        time_delta=updated - timedelta(seconds=1), obj_cls=render_cls.object_class(),
+                        time_field='updated', change_query=change_query, enable_paging=False
+                    )
+                )
+            self.assertEqual(selected[(obj, 'union')], selected[(obj, 'join')])
+        self.assertIn(trans_sip.get_id(), selected[('transactions', 'union')])
+        self.assertIn(trans_sip.submitter_id, selected[('users', 'union')])
+
+    def test_bulk_upload(self):
+        """Test the documents rejected with a 429 are retried and the errors are failures."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.search_sync import bulk_upload
+        cli = StubBulkClient()
+        actions = [
+            {'_op_type': 'update', '_index': 'pacifica_search', '_type': 'doc', '_id': 'users_{}'.format(user_id),
+             'doc': {'obj_id': 'users_{}'.format(user_id)}, 'doc_as_upsert': True}
+            for user_id in range(3)
+        ]
+        with elasticsearch_config(bulk_initial_backoff='0'):
+            failures = bulk_upload(cli, actions)
+        self.assertEqual(cli.requests, [['users_0', 'users_1', 'users_2'], ['users_1']])
+        self.assertEqual([failure['update']['_id'] for failure in failures], ['users_2'])
+
+    def test_cache_generations(self):
+        """Test a shared cache does not return rows changed between two runs."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.metadata.orm import TransSIP, Users
+        from pacifica.elasticsearch.render.cache import TABLE_GENERATIONS, get_cache
+        from pacifica.elasticsearch.render.transactions import TransactionsRender
+        trans_sip = TransSIP.select().order_by(TransSIP.id).first()
+        trans_hash = trans_sip.id.to_hash()
+        user = trans_sip.submitter
+        with elasticsearch_config(
+                cache_size='1000', cache_backend='sqlite', cache_url=os.path.join(mkdtemp(), 'cache.sqlite')):
+            get_cache.cache_clear()
+            TABLE_GENERATIONS.generations.clear()
+            first_doc = TransactionsRender.render(trans_hash, True)
+            Users.update(first_name='Changed', updated=datetime.now()).where(Users.id == user.id).execute()
+            # the next run starts with no generations and shares the cache
+            TABLE_GENERATIONS.generations.clear()
+            get_cache.cache_clear()
+            try:
+                second_doc = TransactionsRender.render(trans_hash, True)
+            finally:
+                Users.update(first_name=user.first_name, updated=datetime.now()).where(Users.id == user.id).execute()
+                get_cache.cache_clear()
+                TABLE_GENERATIONS.generations.clear()
+        self.assertNotIn('Changed', first_doc['users']['submitter'][0]['display_name'])
+        self.assertIn('Changed', second_doc['users']['submitter'][0]['display_name'])
+
+    def test_cache_disabled(self):
+        """Test the turned off cache reads no generations and changed tables are checked in one query."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.metadata.orm import TransSIP
+        from pacifica.elasticsearch.render.cache import TABLE_GENERATIONS, get_cache
+        from pacifica.elasticsearch.render.transactions import TransactionsRender
+        trans_hash = TransSIP.select().order_by(TransSIP.id).first().id.to_hash()
+        with elasticsearch_config(cache_size='0'):
+            get_cache.cache_clear()
+            TABLE_GENERATIONS.generations.clear()
+            uncached_doc = TransactionsRender.render(trans_hash, True)
+            with counted_queries() as invalidate:
+                TABLE_GENERATIONS.invalidate_changed(datetime(1970, 1, 1))
+        self.assertEqual(TABLE_GENERATIONS.generations, {})
+        self.assertEqual(invalidate['queries'], 0)
+        with elasticsearch_config(cache_size='1000', cache_backend='memory'):
+            get_cache.cache_clear()
+            try:
+                self.assertEqual(TransactionsRender.render(trans_hash, True), uncached_doc)
+                with counted_queries() as invalidate:
+                    TABLE_GENERATIONS.invalidate_changed(datetime(1970, 1, 1))
+                self.assertGreater(len(TABLE_GENERATIONS.generations), 1)
+            finally:
+                get_cache.cache_clear()
+                TABLE_GENERATIONS.generations.clear()
+        self.assertEqual(invalidate['queries'], 1)
+
+    def test_celery_queue(self):
+        """Test the celery queue bounds the tasks in flight and resubmits failed pages."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.celery import CeleryQueue
+        from pacifica.elasticsearch.instrumentation import RUN_METRICS
+        # pylint: disable=protected-access
+        RUN_METRICS.drain()
+        queue = CeleryQueue()
+        for page in range(1, 6):
+            queue.put({'object': 'users', 'time_field': 'updated', 'page': page, 'num_pages': 5})
+        task = FakeTask(fail_pages={2: 1, 3: 2})
+        queue._submit(task, 2, 2)
+        self.assertEqual(len(queue.in_flight), 2)
+        self.assertEqual(queue._finished(1), [])
+        queue._submit(task, 2, 2)
+        self.assertEqual(len(task.results), 2)
+        task.finish_all()
+        self.assertEqual(sorted((job['page'], success) for job, success in queue._finished(1)), [(1, True), (4, True)])
+        self.assertEqual(queue.resubmits, {('users', 'updated', 2): 1, ('users', 'updated', 3): 1})
+        queue._submit(task, 2, 2)
+        self.assertEqual(
+            sorted(sorted(job['page'] for job in batch) for batch, _result in queue.in_flight), [[2, 3], [5]]
+        )
+        task.finish_all()
+        self.assertEqual(
+            sorted((job['page'], success) for job, success in queue._finished(1)), [(2, True), (3, False), (5, True)]
+        )
+        self.assertEqual(queue.resubmits, {})
+        self.assertFalse(queue.pending)
+        self.assertFalse(queue.in_flight)
+        # pylint: enable=protected-access
+        self.assertEqual(sorted(job_hash['page'] for job_hash in RUN_METRICS.drain()), [1, 2, 2, 3, 3, 4, 5])
+
+    def test_mapping_hash(self):
+        """Test the index keeps the hash of the installed mapping."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.search_sync import es_client, indexed_mapping_hash, mapping_params
+        self.assertEqual(indexed_mapping_hash(es_client()), mapping_params()['_meta']['mapping_hash'])
+
+    def test_db_pool_size(self):
+        """Test the pool size covers every thread of the pipeline jobs and the url keeps its parameters."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from argparse import Namespace
+        from pacifica.elasticsearch.config import get_config
+        from pacifica.elasticsearch.connections import pooled_db_url
+        from pacifica.elasticsearch.search_sync import db_pool_size
+        self.assertEqual(
+            pooled_db_url('postgresext+pool://user@host/db?max_connections=2', 5),
+            'postgresext+pool://user@host/db?max_connections=2&stale_timeout=300&timeout=60'
+        )
+        self.assertEqual(
+            pooled_db_url('sqlite+pool:////tmp/metadata.db', 3),
+            'sqlite+pool:////tmp/metadata.db?max_connections=3&stale_timeout=300&timeout=60'
+        )
+        fetch = get_config().getint('elasticsearch', 'pipeline_fetch_workers')
+        render = get_config().getint('elasticsearch', 'pipeline_render_workers')
+        self.assertEqual(
+            db_pool_size(Namespace(celery=False, processes=0, use_async=False, threads=2, pipeline=True)),
+            2 * (1 + fetch + render) + 1
+        )
+
+    def test_db_pool(self):
+        """Test the pool is sized from the url and the thread connection goes back to it."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from threading import Thread
+        from playhouse.pool import MaxConnectionsExceeded, PooledSqliteDatabase
+        from pacifica.elasticsearch.connections import configure_db_pool, thread_connection
+        from pacifica.elasticsearch.instrumentation import JobMetrics, activate
+        database = PooledSqliteDatabase(None)
+        configure_db_pool(database, 1, 'sqlite+pool:///:memory:?timeout=1&check_same_thread=false')
+        metrics = JobMetrics({'object': 'users', 'time_field': 'created', 'page': 1})
+        exhausted = []
+
+        def other_thread():
+            """Try to connect while the only pooled connection is taken."""
+            try:
+                with thread_connection(database):
+                    pass  # pragma: no cover
+            except MaxConnectionsExceeded:
+                exhausted.append(True)
+        with activate(metrics), thread_connection(database):
+            database.execute_sql('SELECT 1')
+            thread = Thread(target=other_thread)
+            thread.start()
+            thread.join()
+        self.assertEqual(exhausted, [True])
+        self.assertTrue(database.is_closed())
+        self.assertEqual(metrics.counters['db_connections'], 1)
+        with thread_connection(database):
+            database.execute_sql('SELECT 1')
+
+    def test_thread_connection_reuse(self):
+        """Test a connection from outside a pool is kept for the next job of the thread unless asked."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from peewee import SqliteDatabase
+        from pacifica.elasticsearch.connections import thread_connection
+        from pacifica.elasticsearch.instrumentation import JobMetrics, activate
+        database = SqliteDatabase(':memory:')
+        metrics = JobMetrics({'object': 'users', 'time_field': 'created', 'page': 1})
+        with activate(metrics):
+            for _job in range(2):
+                with thread_connection(database):
+                    database.execute_sql('SELECT 1')
+                self.assertFalse(database.is_closed())
+            database.close()
+            with thread_connection(database, reuse=False):
+                database.execute_sql('SELECT 1')
+        self.assertTrue(database.is_closed())
+        self.assertEqual(metrics.counters['db_connections'], 2)
+
+    def test_index_rebuild(self):
+        """Test the rebuilt index is swapped in behind the alias."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        from pacifica.elasticsearch.rebuild import IndexRebuild
+        from pacifica.elasticsearch.search_sync import es_client, mapping_params
+        with self.assertRaises(ValueError):
+            main('--rebuild', '--object', 'users')
+        with self.assertRaises(ValueError):
+            main('--rebuild', '--skip-unchanged')
+        requests.delete('http://localhost:9200/pacifica_rebuild_test_*')
+        for version in ['1', '2']:
+            rebuild = IndexRebuild(es_client(), 'pacifica_rebuild_test', version)
+            rebuild.create(mapping_params())
+            rebuild.finish()
+        resp = requests.get('http://localhost:9200/_alias/pacifica_rebuild_test')
+        self.assertEqual(list(resp.json()), ['pacifica_rebuild_test_2'])
+        resp = requests.get('http://localhost:9200/pacifica_rebuild_test_2/_settings')
+        self.assertNotEqual(resp.json()['pacifica_rebuild_test_2']['settings']['index'].get('refresh_interval'), '-1')
+        client = SimpleNamespace(indices=SimpleNamespace(
+            get_settings=lambda **_kwargs: {'pacifica_rebuild_test_2': {}}
+        ))
+        with self.assertRaises(ValueError):
+            IndexRebuild(client, 'pacifica_rebuild_test', '3').finish()
+
+    def test_main_rebuild(self):
+        """Test a full rebuild from main indexes every document into a new index behind the alias."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        from pacifica.elasticsearch.search_sync import _BOOTSTRAP
+        self.test_main()
+        try:
+            self.assertIs(main('--rebuild', '--objects-per-page', '4', '--threads', '1'), True)
+            resp = requests.get('http://localhost:9200/_alias/pacifica_search')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.json()), 1)
+            self.assertRegex(list(resp.json())[0], r'^pacifica_search_\d{14}$')
+            resp = requests.get('http://localhost:9200/pacifica_search/doc/transactions_67')
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            # the other tests expect a plain index
+            requests.delete('http://localhost:9200/pacifica_search_*')
+            _BOOTSTRAP['done'] = False
+        self.test_main()
+
+    def test_main_since_last_sync(self):
+        """Test the checkpoint is saved and used by the next sync."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.__main__ import main
+        checkpoint_file = os.path.join(mkdtemp(), 'checkpoint.json')
+        main('--objects-per-page', '4', '--threads', '1', '--checkpoint-file', checkpoint_file,
+             '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        with open(checkpoint_file) as checkpoint_fd:
+            checkpoint = json.loads(checkpoint_fd.read())
+        self.assertEqual(set(checkpoint.keys()), set(['keys', 'values', 'relationships', 'transactions',
+                                                      'projects', 'science_themes', 'users', 'instruments',
+                                                      'institutions', 'groups']))
+        self.assertTrue(checkpoint['transactions']['updated'])
+        main('--objects-per-page', '4', '--threads', '1', '--checkpoint-file', checkpoint_file,
+             '--since-last-sync', '--celery')
+        sleep(3)
+        resp = requests.get('http://localhost:9200/pacifica_search/doc/transactions_67')
+        self.assertEqual(resp.status_code, 200)
 
     def test_main_celery(self):
         """Test the add method in example class."""
@@ -92,6 +656,8 @@ class TestElasticsearch(TestCase):
         from pacifica.elasticsearch.__main__ import main
         main('--objects-per-page', '4', '--celery',
              '--exclude', 'keys.key=temp_f', '--time-ago', '3650 days after')
+        with open(self.env_hash['PROMETHEUS_TEXTFILE']) as prom_fd:
+            self.assertIn('pacifica_search_sync_docs{object="transactions"}', prom_fd.read())
         sleep(3)
         resp = requests.post('http://localhost:9200/pacifica_search/_flush/synced')
         self.assertEqual(resp.status_code, 200)
@@ -133,6 +699,219 @@ class TestElasticsearch(TestCase):
             json_data = resp.json()
             jsonschema.validate(json_data, json_schema)
 
+    def test_prefetch_render(self):
+        """Test the documents rendered with and without the prefetch are the same."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.elasticsearch.search_render import SearchRender
+        from pacifica.elasticsearch.celery import SYNC_OBJECTS
+        for obj in SYNC_OBJECTS:
+            render_cls = SearchRender.get_render_class(obj)
+            objs = list(render_cls.stream_objects(render_cls.get_select_query(
+                time_delta=datetime(1970, 1, 1), obj_cls=render_cls.object_class(), time_field='updated',
+                page=1, items_per_page=100
+            )))
+            self.assertTrue(objs, '{} has no objects to render'.format(obj))
+            self.assertEqual(
+                list(SearchRender.generate(obj, objs, [])),
+                [action for obj_hash in objs for action in SearchRender.generate_obj(obj, render_cls, obj_hash)],
+                '{} rendered differently with the prefetch'.format(obj)
+            )
+
+    def test_files_summary_prefetch(self):
+        """Test the file aggregates of a page of transactions take one query instead of one per transaction."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.elasticsearch.render.cache import get_cache
+        from pacifica.elasticsearch.search_render import SearchRender
+        render_cls = SearchRender.document_render_class('transactions', True)
+        objs = list(render_cls.stream_objects(render_cls.get_select_query(
+            time_delta=datetime(1970, 1, 1), obj_cls=render_cls.object_class(), time_field='updated',
+            page=1, items_per_page=10
+        )))
+        with elasticsearch_config(cache_size='0'):
+            get_cache.cache_clear()
+            with counted_queries() as per_transaction:
+                expected = [
+                    action for obj_hash in objs
+                    for action in SearchRender.generate_obj('transactions', render_cls, obj_hash)
+                ]
+            with counted_queries() as per_page:
+                actions = list(SearchRender.generate('transactions', objs, [], True))
+        get_cache.cache_clear()
+        self.assertEqual(actions, expected)
+        self.assertEqual(per_transaction['callers']['TransactionsSummaryRender.files_summary_obj_lists'], len(objs))
+        self.assertNotIn('TransactionsSummaryRender.files_summary_obj_lists', per_page['callers'])
+        self.assertLess(per_page['queries'], per_transaction['queries'])
+
+    @staticmethod
+    def create_release_states():
+        """Create transactions released with a DOI, released without a DOI and unreleased and return their ids."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.metadata.orm import DOIEntries, DOITransaction, TransactionUser, Transactions, Users
+        from pacifica.elasticsearch.render.transactions import TransactionsRender
+        user = Users.select().order_by(Users.id).first()
+        trans_ids = [Transactions.create(description='release status {}'.format(i)).id for i in range(3)]
+        trans_users = [
+            TransactionUser.create(user=user, transaction=trans_id, relationship=TransactionsRender.releaser_uuid)
+            for trans_id in trans_ids[:2]
+        ]
+        DOIEntries.create(doi='10.5555/release.status', site_url='https://example.com', creator=user)
+        DOITransaction.create(doi='10.5555/release.status', transaction=trans_users[0].uuid)
+        return trans_ids
+
+    def test_release_status(self):
+        """Test the grouped release query matches the lookup per transaction."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.metadata.orm import Transactions
+        from pacifica.metadata.orm.globals import DB
+        from pacifica.elasticsearch.render.prefetch import PrefetchContext
+        from pacifica.elasticsearch.render.transactions import TransactionsRender
+        with DB.atomic() as txn:
+            trans_ids = self.create_release_states()
+            released = {
+                trans_id: TransactionsRender.release_status(trans_id)
+                for (trans_id,) in Transactions.select(Transactions.id).tuples()
+            }
+            context = PrefetchContext()
+            context.load_release(released.keys(), TransactionsRender.releaser_uuid)
+            txn.rollback()
+        self.assertEqual(released[trans_ids[0]], (True, '10.5555/release.status'))
+        self.assertEqual(released[trans_ids[1]], (True, None))
+        self.assertEqual(released[trans_ids[2]], (False, None))
+        for trans_id, status in released.items():
+            self.assertEqual(context.release[str(trans_id)], status)
+
+    @staticmethod
+    def science_theme_projects():
+        """Return the projects and transaction ids of each science theme."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.metadata.orm import Projects, TransSIP, TransSAP
+        ret = {}
+        query = Projects.select().where(Projects.where_clause({}) & Projects.science_theme.is_null(False))
+        for proj_obj in query.execute():
+            projects, trans_ids = ret.setdefault(proj_obj.science_theme, ([], set()))
+            projects.append(proj_obj)
+            for trans_cls in [TransSIP, TransSAP]:
+                trans_query = trans_cls.select(trans_cls.id).where(
+                    trans_cls.where_clause({}) & (trans_cls.project == proj_obj.id)
+                )
+                trans_ids.update('transactions_{}'.format(trans_id) for (trans_id,) in trans_query.tuples())
+        return ret
+
+    def test_science_themes(self):
+        """Test each science theme is rendered once from all the projects having it."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from datetime import datetime
+        from pacifica.metadata.orm import Projects
+        from pacifica.elasticsearch.search_render import SearchRender
+        render_cls = SearchRender.get_render_class('science_themes')
+        themes = list(render_cls.stream_objects(render_cls.get_select_query(
+            time_delta=datetime(1970, 1, 1), obj_cls=Projects, time_field='updated', enable_paging=False
+        )))
+        theme_projects = self.science_theme_projects()
+        self.assertTrue(theme_projects)
+        self.assertEqual([theme['science_theme'] for theme in themes], sorted(theme_projects))
+        docs = {action['_id']: action['doc'] for action in SearchRender.generate('science_themes', themes, [])}
+        for theme in themes:
+            projects, trans_ids = theme_projects[theme['science_theme']]
+            doc = docs['science_themes_{}'.format(theme['science_theme'])]
+            self.assertEqual(doc['display_name'], theme['science_theme'])
+            self.assertEqual(doc['updated_date'], max(proj.updated for proj in projects).isoformat())
+            self.assertEqual(doc['created_date'], min(proj.created for proj in projects).isoformat())
+            self.assertEqual(doc['transaction_ids'], sorted(trans_ids))
+            self.assertEqual(doc['transaction_count'], len(trans_ids))
+            self.assertEqual(render_cls.get_transactions(**theme), sorted(trans_ids))
+
+    def test_render_memo(self):
+        """Test the sub-documents are rendered once while the memo is open and every thread shares it."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from threading import Thread
+        from pacifica.metadata.orm import Users
+        from pacifica.elasticsearch.render.base import render_memo
+        from pacifica.elasticsearch.render.users import UsersRender
+        user_hash = Users.select().order_by(Users.id).first().to_hash()
+        self.assertIsNot(UsersRender.render_memoized(user_hash), UsersRender.render_memoized(user_hash))
+        thread_docs = []
+        with render_memo() as docs:
+            user_doc = UsersRender.render_memoized(user_hash)
+            self.assertIs(UsersRender.render_memoized(dict(user_hash)), user_doc)
+            self.assertEqual(len(docs), 1)
+            self.assertIsNot(UsersRender.render_memoized(user_hash, render_trans_ids=True), user_doc)
+            self.assertIsNot(UsersRender.render_memoized(dict(user_hash, updated='changed')), user_doc)
+            self.assertEqual(len(docs), 3)
+            with render_memo() as nested_docs:
+                self.assertIs(nested_docs, docs)
+                self.assertIs(UsersRender.render_memoized(user_hash), user_doc)
+            self.assertIs(UsersRender.render_memoized(user_hash), user_doc)
+            thread = Thread(target=lambda: thread_docs.append(UsersRender.render_memoized(user_hash)))
+            thread.start()
+            thread.join()
+            self.assertIs(thread_docs[0], user_doc)
+        self.assertIsNot(UsersRender.render_memoized(user_hash), user_doc)
+        with elasticsearch_config(render_memo_size='2'), render_memo() as docs:
+            for user in Users.select().limit(3).execute():
+                UsersRender.render_memoized(user.to_hash())
+            self.assertEqual(len(docs), 2)
+
+    def test_field_renderers(self):
+        """Test the field renderers render the same strings as the field methods did before the templates."""
+        # The environment needs to be set before import
+        # pylint: disable=import-outside-toplevel
+        from pacifica.elasticsearch.search_render import SearchRender
+        dates = {'updated': '2020-01-02T03:04:05', 'created': '2019-01-02T03:04:05'}
+        rendered_dates = {'updated_date': '2020-01-02T03:04:05', 'created_date': '2019-01-02T03:04:05'}
+        examples = [
+            ('users', dict(dates, _id=999999, first_name='Jane', last_name='Doe', middle_initial='Q'), {
+                'obj_id': 'users_999999', 'display_name': 'Doe, Jane Q', 'keyword': 'Doe, Jane Q', 'release': 'false'
+            }),
+            ('files', dict(
+                dates, _id=999999, name='data.csv', subdir='run/1', mtime='2019-05-06T07:08:09',
+                ctime='2019-05-06T07:08:10', size=1234, hashsum='abc123', hashtype='sha1', transaction=999999
+            ), {
+                'obj_id': 'files_999999', 'display_name': 'run/1/data.csv', 'mtime': '2019-05-06T07:08:09',
+                'ctime': '2019-05-06T07:08:10', 'keyword': 'run 1 data.csv', 'name': 'data.csv', 'subdir': 'run/1',
+                'size': '1234', 'hashsum': 'abc123', 'hashtype': 'sha1'
+            }),
+            ('projects', dict(
+                dates, _id='99999x', title='Soil Carbon', abstract='Carbon in soil.',
+                actual_start_date='2019-02-01', actual_end_date=None, closed_date=None
+            ), {
+                'obj_id': 'projects_99999x', 'display_name': 'Soil Carbon', 'abstract': 'Carbon in soil.',
+                'title': 'Soil Carbon', 'keyword': 'Soil Carbon', 'release': 'false', 'closed_date': None,
+                'actual_end_date': None, 'actual_start_date': '2019-02-01'
+            }),
+            ('institutions', dict(dates, _id=999999, name='Example Lab'), {
+                'obj_id': 'institutions_999999', 'display_name': 'Example Lab', 'keyword': 'Example Lab',
+                'release': 'true'
+            }),
+            ('groups', dict(dates, _id=999999, name='admin', display_name='Administrators'), {
+                'obj_id': 'groups_999999', 'display_name': 'Administrators', 'keyword': 'admin', 'release': 'true'
+            }),
+            ('keys', dict(dates, _id=999999, key='temp_f', display_name='Temperature'), {
+                'obj_id': 'keys_999999', 'display_name': 'Temperature', 'keyword': 'temp_f', 'release': 'true'
+            }),
+            ('values', dict(dates, _id=999999, value='72', display_name='Seventy two'), {
+                'obj_id': 'values_999999', 'display_name': 'Seventy two', 'keyword': '72', 'release': 'true'
+            }),
+            ('instruments', dict(dates, _id=999999, display_name='NMR 800'), {
+                'obj_id': 'instruments_999999', 'display_name': 'NMR 800', 'keyword': 'NMR 800', 'release': 'true'
+            })
+        ]
+        for obj, obj_hash, expected in examples:
+            with self.subTest(obj=obj):
+                self.assertEqual(
+                    SearchRender.get_render_class(obj).render(obj_hash),
+                    dict(expected, type=obj, **rendered_dates)
+                )
+
     def test_keyword_query(self):
         """Test the keyword query for users."""
         self.test_main()